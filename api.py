@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.process
+import tornado.web
+
+import scoring
+from batching import scoring_batcher
+from metrics import metrics
+from scoring import get_severity_level
+
+# Headless scoring service: loads the model and vectorizer once per process and
+# scores on a thread pool so the event loop keeps accepting requests.
+#
+#   python api.py --port 8000 --processes 4 --threads 4
+#
+#   POST /score        {"message": "..."}
+#   POST /score/batch  {"messages": ["...", "..."]}
+#   GET  /health       (includes prediction cache hit/miss counters)
+#   GET  /metrics      (per-stage latency histograms, Prometheus text format; per process)
+
+MAX_BATCH_SIZE = 10000
+
+# Model files default to the ones next to this script, whatever the working directory
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def make_record(prediction, confidence, severity):
+    severity_level, _, _ = get_severity_level(severity)
+    return {
+        "classification": str(prediction),
+        "confidence": round(float(confidence), 2),
+        "severity": severity,
+        "severity_level": severity_level,
+        "status": "safe" if prediction.lower() == "not_cyberbullying" else "flagged"
+    }
+
+def score_records(model, vectorizer, messages, cache=None):
+    predictions, confidences, severities = scoring.score_batch(model, vectorizer, messages, cache=cache)
+    return [make_record(*result) for result in zip(predictions, confidences, severities)]
+
+class BaseHandler(tornado.web.RequestHandler):
+    def set_default_headers(self):
+        self.set_header("Content-Type", "application/json")
+
+    def write_error(self, status_code, **kwargs):
+        self.finish({"error": self._reason})
+
+    def json_body(self):
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Request body must be valid JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Request body must be a JSON object")
+        return body
+
+    async def score(self, messages):
+        app = self.application
+        return await tornado.ioloop.IOLoop.current().run_in_executor(
+            app.executor, score_records, app.model, app.vectorizer, messages, app.cache)
+
+class HealthHandler(BaseHandler):
+    def get(self):
+        self.write({
+            "status": "ok",
+            "classes": [str(label) for label in self.application.model.classes_],
+            "prediction_cache": self.application.cache.stats()
+        })
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.prometheus_text())
+
+class ScoreHandler(BaseHandler):
+    async def post(self):
+        message = self.json_body().get("message")
+        if not isinstance(message, str):
+            raise tornado.web.HTTPError(400, reason="'message' must be a string")
+        # Single messages go through the micro-batcher so concurrent requests share one model call
+        with metrics.span("request_score"):
+            result = await asyncio.wrap_future(self.application.batcher.submit(message))
+        self.write(make_record(result.prediction, result.confidence, result.severity))
+
+class BatchScoreHandler(BaseHandler):
+    async def post(self):
+        messages = self.json_body().get("messages")
+        if not isinstance(messages, list) or not all(isinstance(message, str) for message in messages):
+            raise tornado.web.HTTPError(400, reason="'messages' must be a list of strings")
+        if len(messages) > MAX_BATCH_SIZE:
+            raise tornado.web.HTTPError(413, reason=f"At most {MAX_BATCH_SIZE} messages per batch")
+        with metrics.span("request_score_batch"):
+            records = await self.score(messages)
+        self.write({"results": records})
+
+# `model_path`/`vectorizer_path` are the files the model was loaded from; the
+# prediction cache is keyed on their fingerprint
+def make_app(model, vectorizer, threads, batch_size=64, batch_wait_ms=5, cache_mb=64,
+             model_path=scoring.MODEL_PATH, vectorizer_path=scoring.VECTORIZER_PATH):
+    app = tornado.web.Application([
+        (r"/health", HealthHandler),
+        (r"/metrics", MetricsHandler),
+        (r"/score", ScoreHandler),
+        (r"/score/batch", BatchScoreHandler),
+    ])
+    app.model = model
+    app.vectorizer = vectorizer
+    app.executor = ThreadPoolExecutor(max_workers=threads)
+    app.cache = scoring.make_prediction_cache(max_bytes=int(cache_mb * 1024 * 1024), model_path=model_path,
+                                              vectorizer_path=vectorizer_path)
+    app.batcher = scoring_batcher(model, vectorizer, max_batch_size=batch_size, max_wait_ms=batch_wait_ms, cache=app.cache)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="CyberGuard AI scoring API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="server processes sharing the listening socket (0 = one per CPU)")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1,
+                        help="scoring threads per process")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="maximum single-message requests scored together")
+    parser.add_argument("--batch-wait-ms", type=float, default=5,
+                        help="how long the micro-batcher waits to fill a batch")
+    parser.add_argument("--cache-mb", type=float, default=64,
+                        help="memory budget of the per-process prediction cache")
+    parser.add_argument("--model", default=os.path.join(HERE, scoring.MODEL_PATH))
+    parser.add_argument("--vectorizer", default=os.path.join(HERE, scoring.VECTORIZER_PATH))
+    args = parser.parse_args()
+
+    # Models are loaded before forking so worker processes share the pages
+    model, vectorizer = scoring.load_models(args.model, args.vectorizer)
+    sockets = tornado.netutil.bind_sockets(args.port, address=args.host)
+    if args.processes != 1:
+        tornado.process.fork_processes(args.processes)
+
+    server = tornado.httpserver.HTTPServer(make_app(model, vectorizer, args.threads, args.batch_size, args.batch_wait_ms,
+                                                    args.cache_mb, args.model, args.vectorizer))
+    server.add_sockets(sockets)
+    tornado.ioloop.IOLoop.current().start()
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
 import streamlit as st
-import joblib
-import re
-import csv
-import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from streamlit_lottie import st_lottie
-import requests
 from datetime import datetime, timedelta
 import time
 import io
+import os
+import tempfile
+import scoring
+from assets import load_lottie
+from storage import FlagStore, FlagWriter
+from clustering import NearDuplicateIndex
+from exports import EXPORT_FORMATS, available_formats, export_filename, format_confidence, write_export
+from batching import scoring_batcher
+from parallel import ParallelScorer
+from scoring import abusive_lexicon, get_severity_level
+from metrics import metrics
 
 # Page configuration
 st.set_page_config(
@@ -26,54 +32,162 @@ if 'page' not in st.session_state:
 # Load model and vectorizer
 @st.cache_resource
 def load_models():
-    model = joblib.load("cyberbullying_model.pkl")
-    vectorizer = joblib.load("tfidf_vectorizer.pkl")
-    return model, vectorizer
+    return scoring.load_models()
 
 model, vectorizer = load_models()
 
-# Abusive words dictionary
-abusive_words = ["idiot", "stupid", "hate", "dumb", "loser", "kill", "ugly", "die", "pathetic", "worthless", 
-                 "trash", "garbage", "scum", "disgusting", "failure"]
+# Single-message requests from concurrent sessions are scored together
+MICRO_BATCH_MAX_ITEMS = 32
+MICRO_BATCH_MAX_WAIT_MS = 2
 
-# Severity scoring system
-def calculate_severity(prediction, confidence, text):
-    base_scores = {
-        "not_cyberbullying": 0,
-        "age": 60,
-        "ethnicity": 85,
-        "gender": 75,
-        "religion": 80,
-        "other_cyberbullying": 70
+# Repeated messages are answered from the prediction cache without touching the model
+PREDICTION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+@st.cache_resource
+def get_prediction_cache():
+    return scoring.make_prediction_cache(max_bytes=PREDICTION_CACHE_MAX_BYTES)
+
+@st.cache_resource
+def get_batcher():
+    return scoring_batcher(model, vectorizer, max_batch_size=MICRO_BATCH_MAX_ITEMS, max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+                           cache=get_prediction_cache())
+
+def cache_stats_caption():
+    stats = get_prediction_cache().stats()
+    return (f"🗃️ Prediction cache: {stats['hits']:,} hits · {stats['misses']:,} misses · "
+            f"{stats['hit_rate'] * 100:.1f}% hit rate · {stats['entries']:,} entries")
+
+# Flagged message store. Flags are queued and committed in batches by one
+# background writer; the durability policy is SQLite's synchronous pragma.
+FLAG_DB_SYNCHRONOUS = os.environ.get("CYBERGUARD_DB_SYNCHRONOUS", "NORMAL")
+FLAG_WRITE_BATCH_SIZE = 500
+FLAG_WRITE_INTERVAL = 0.05
+FLAG_FLUSH_TIMEOUT = 2
+
+# Flags older than this many days are rotated into per-day history segments
+# in HISTORY_ARCHIVE_FORMAT (segments in any other format are converted once)
+HISTORY_RETAIN_DAYS = int(os.environ.get("CYBERGUARD_RETAIN_DAYS", 30))
+HISTORY_ARCHIVE_FORMAT = os.environ.get("CYBERGUARD_ARCHIVE_FORMAT", "parquet")
+
+# Flags are grouped into near-duplicate clusters as they are logged (the first
+# start after a model change re-clusters the stored history)
+@st.cache_resource
+def get_store():
+    store = FlagStore(synchronous=FLAG_DB_SYNCHRONOUS, archive_format=HISTORY_ARCHIVE_FORMAT,
+                      clusterer=NearDuplicateIndex(vectorizer, model))
+    store.migrate_archive()
+    return store
+
+@st.cache_resource
+def get_flag_writer():
+    return FlagWriter(get_store(), max_batch_size=FLAG_WRITE_BATCH_SIZE, flush_interval=FLAG_WRITE_INTERVAL)
+
+# Store for pages that read it, after this process's queued flags are committed
+# (and, once a day, old flags are rotated out of the live table)
+def get_synced_store():
+    writer = get_flag_writer()
+    writer.flush(timeout=FLAG_FLUSH_TIMEOUT)
+    if writer.failed:
+        st.warning(f"⚠️ {writer.failed:,} flagged messages could not be saved (last error: {writer.last_error})")
+    store = get_store()
+    store.rotate_daily(HISTORY_RETAIN_DAYS)
+    return store
+
+# Map the Reports filter widgets to FlagStore.query arguments. Date ranges
+# start at midnight, so `since` stays the same across reruns all day and the
+# cached search pages and segment stats keyed on it are reused.
+REPORT_SEVERITY_FILTERS = {"Low (0-40)": "low", "Medium (40-80)": "medium", "High (80-100)": "high"}
+
+def report_filters(severity_filter, type_filter, date_range):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    since = None
+    if date_range == "Today":
+        since = today
+    elif date_range == "Last 7 Days":
+        since = today - timedelta(days=7)
+    elif date_range == "Last 30 Days":
+        since = today - timedelta(days=30)
+    return {
+        "severity": REPORT_SEVERITY_FILTERS.get(severity_filter),
+        "label": None if type_filter == "All" else type_filter,
+        "since": since,
     }
-    base = base_scores.get(prediction.lower(), 50)
-    confidence_factor = confidence / 100
-    abusive_count = sum(1 for word in abusive_words if re.search(rf"\b{word}\b", text, re.IGNORECASE))
-    abusive_factor = min(abusive_count * 5, 20)
-    severity = min(100, base * confidence_factor + abusive_factor)
-    return round(severity, 1)
 
-def get_severity_level(score):
-    if score < 20:
-        return "SAFE", "#10b981", "🟢"
-    elif score < 40:
-        return "LOW", "#3b82f6", "🔵"
-    elif score < 60:
-        return "MEDIUM", "#f59e0b", "🟡"
-    elif score < 80:
-        return "HIGH", "#f97316", "🟠"
+# Reports table page sizes (rows fetched per rerun)
+REPORT_PAGE_SIZES = [25, 50, 100, 250]
+
+# Report formatting, vectorized over whole columns
+def format_report_page(df):
+    df = df.copy()
+    message = df['Message'].astype(str)
+    df['Message'] = message.where(message.str.len() <= 80, message.str.slice(0, 80) + '...')
+    # Mapping a categorical column title-cases each category once, not each row
+    df['Type'] = df['Type'].map(lambda label: label.replace("_", " ").title())
+    df['Confidence'] = format_confidence(df['Confidence'])
+    df['Timestamp'] = df['Timestamp'].dt.strftime('%Y-%m-%d %H:%M')
+    return df
+
+# One ranked page of search results; reruns with the same search, filters and
+# page (and no new flags) reuse it instead of re-reading archived segments
+@st.cache_data(max_entries=32, show_spinner=False)
+def search_page(text, severity, label, since, limit, offset, data_version):
+    return get_store().search(text, severity, label, since, limit=limit, offset=offset)
+
+# Rows of a streamed CSV upload kept for the on-screen preview
+STREAM_PREVIEW_ROWS = 1000
+
+# Home page animation (bundled copy is shown until the remote one is cached)
+SHIELD_LOTTIE_URL = "https://assets9.lottiefiles.com/packages/lf20_kxsd2ytq.json"
+SHIELD_LOTTIE_FALLBACK = "assets/shield_lottie.json"
+
+# Score a list of messages chunk by chunk with the batch engine
+def score_messages_frame(messages, scorer=None):
+    frames = []
+    done = 0
+    progress = st.progress(0)
+    chunks = scoring.iter_chunks(messages, scoring.BATCH_CHUNK_SIZE)
+    if scorer is None:
+        scored = ((chunk, scoring.score_batch(model, vectorizer, chunk, cache=get_prediction_cache())) for chunk in chunks)
     else:
-        return "CRITICAL", "#ef4444", "🔴"
+        scored = scorer.imap(chunks)
+    for chunk, (predictions, confidences, severities) in scored:
+        frames.append(scoring.batch_results_frame(chunk, predictions, confidences, severities))
+        done += len(chunk)
+        progress.progress(done / len(messages))
+    progress.empty()
+    if not frames:
+        return scoring.batch_results_frame([], [], [], [])
+    return pd.concat(frames, ignore_index=True)
+
+# Process pool for multi-core batch scoring, started on first use
+@st.cache_resource
+def get_parallel_scorer():
+    return ParallelScorer()
 
-# Load Lottie animation
-def load_lottieurl(url):
-    try:
-        r = requests.get(url, timeout=5)
-        if r.status_code != 200:
-            return None
-        return r.json()
-    except:
-        return None
+# Stage timings are also written in Prometheus text format to this file, if set
+METRICS_FILE = os.environ.get("CYBERGUARD_METRICS_FILE")
+METRICS_EXPORT_INTERVAL = 15
+
+@st.cache_resource
+def start_metrics_export():
+    return metrics.export_periodically(METRICS_FILE, METRICS_EXPORT_INTERVAL)
+
+if METRICS_FILE:
+    start_metrics_export()
+
+# Admin panel: latency percentiles per stage (estimated from the histograms)
+def render_admin_panel():
+    with st.sidebar.expander("⏱️ Performance Metrics"):
+        summary = metrics.summary()
+        if not summary:
+            st.caption("No timings recorded yet.")
+            return
+        st.dataframe(pd.DataFrame(summary).set_index("stage").round(2), use_container_width=True)
+        st.download_button("📥 Prometheus Metrics", metrics.prometheus_text(), "metrics.prom", "text/plain",
+                           use_container_width=True)
+        if st.button("Reset Metrics", use_container_width=True):
+            metrics.reset()
+            st.rerun()
 
 # Custom CSS - White Background with Modern Design
 st.markdown("""
@@ -508,7 +622,7 @@ def render_footer():
 
 # HOME PAGE
 def home_page():
-    lottie_shield = load_lottieurl("https://assets9.lottiefiles.com/packages/lf20_kxsd2ytq.json")
+    lottie_shield = load_lottie(SHIELD_LOTTIE_URL, SHIELD_LOTTIE_FALLBACK)
     
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
@@ -622,11 +736,7 @@ def home_page():
         """, unsafe_allow_html=True)
     
     with col3:
-        try:
-            df = pd.read_csv("flagged_messages.csv")
-            total_analyzed = len(df)
-        except:
-            total_analyzed = 0
+        total_analyzed = get_synced_store().total()
         
         st.markdown(f"""
         <div class="stat-card">
@@ -677,18 +787,23 @@ def analyze_page():
                 """, unsafe_allow_html=True)
             else:
                 with st.spinner('Analyzing message...'):
-                    progress_bar = st.progress(0)
-                    for i in range(100):
-                        time.sleep(0.01)
-                        progress_bar.progress(i + 1)
-                    
-                    vect_input = vectorizer.transform([user_input])
-                    prediction = model.predict(vect_input)[0]
-                    prediction_proba = np.max(model.predict_proba(vect_input)) * 100
-                    severity_score = calculate_severity(prediction, prediction_proba, user_input)
+                    started = time.perf_counter()
+                    result = get_batcher().score(user_input)
+                    total_ms = (time.perf_counter() - started) * 1000
+                    metrics.observe("request_score", total_ms / 1000)
+                    prediction, prediction_proba, severity_score = result.prediction, result.confidence, result.severity
                     severity_level, severity_color, severity_icon = get_severity_level(severity_score)
-                    
-                    progress_bar.empty()
+                
+                # Measured stage timings (vectorize/predict/severity cover the micro-batch this message was scored in)
+                timings = result.timings
+                st.caption(
+                    f"⏱️ Vectorize {timings.get('vectorize', 0.0) * 1000:.1f} ms · "
+                    f"Predict {timings.get('predict', 0.0) * 1000:.1f} ms · "
+                    f"Severity {timings.get('severity', 0.0) * 1000:.1f} ms · "
+                    f"Total {total_ms:.1f} ms"
+                    + (f" (batched with {timings['batch_size'] - 1} other messages)" if timings['batch_size'] > 1 else "")
+                )
+                st.caption(cache_stats_caption())
                 
                 st.markdown("---")
                 st.markdown("### 📊 Analysis Results")
@@ -746,21 +861,13 @@ def analyze_page():
                 """, unsafe_allow_html=True)
                 
                 # Message Preview with highlighting
-                def highlight_abusive(text):
-                    for word in abusive_words:
-                        pattern = re.compile(rf"\b{word}\b", re.IGNORECASE)
-                        text = pattern.sub(f"**:red[{word.upper()}]**", text)
-                    return text
-                
                 st.markdown("#### Message Preview")
-                highlighted_text = highlight_abusive(user_input)
+                highlighted_text = abusive_lexicon.matcher().highlight(user_input)
                 st.markdown(f"> {highlighted_text}")
                 
                 # Log the message
                 if prediction.lower() != "not_cyberbullying":
-                    with open("flagged_messages.csv", "a", newline="", encoding="utf-8") as f:
-                        writer = csv.writer(f)
-                        writer.writerow([user_input, prediction, f"{prediction_proba:.2f}%", severity_score, datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
+                    get_flag_writer().append(user_input, prediction, prediction_proba, severity_score)
                     
                     st.markdown(f"""
                     <div class="alert-box alert-danger">
@@ -781,59 +888,60 @@ def analyze_page():
         st.info("Upload a CSV file with a 'message' column or paste multiple messages (one per line)")
         
         upload_method = st.radio("Input Method:", ["Upload CSV", "Paste Text"], horizontal=True)
+        use_parallel = st.toggle(f"⚡ Parallel scoring across {os.cpu_count() or 1} CPU cores",
+                                 help="Shards large batches across worker processes. Bypasses the prediction cache.")
+        batch_scorer = get_parallel_scorer() if use_parallel else None
         
         if upload_method == "Upload CSV":
             uploaded_file = st.file_uploader("Choose a CSV file", type=['csv'])
             
             if uploaded_file is not None:
                 try:
-                    df_upload = pd.read_csv(uploaded_file)
-                    if 'message' not in df_upload.columns:
+                    # Only the header is parsed here; rows are streamed when analysis starts
+                    header_df = pd.read_csv(uploaded_file, nrows=0)
+                    uploaded_file.seek(0)
+                    if 'message' not in header_df.columns:
                         st.error("CSV must contain a 'message' column")
                     else:
-                        st.success(f"✅ Loaded {len(df_upload)} messages")
+                        st.success(f"✅ Ready to analyze {uploaded_file.name} ({uploaded_file.size / 1024:,.1f} KB)")
                         
                         if st.button("🔍 Analyze All Messages", use_container_width=True):
-                            results = []
                             progress = st.progress(0)
+                            preview_frames = []
+                            preview_rows = [0]
                             
-                            for idx, row in df_upload.iterrows():
-                                message = str(row['message'])
-                                vect_input = vectorizer.transform([message])
-                                prediction = model.predict(vect_input)[0]
-                                prediction_proba = np.max(model.predict_proba(vect_input)) * 100
-                                severity = calculate_severity(prediction, prediction_proba, message)
-                                
-                                results.append({
-                                    'Message': message[:50] + '...' if len(message) > 50 else message,
-                                    'Classification': prediction.replace("_", " ").title(),
-                                    'Confidence': f"{prediction_proba:.1f}%",
-                                    'Severity': severity,
-                                    'Status': 'Safe' if prediction.lower() == 'not_cyberbullying' else 'Flagged'
-                                })
-                                
-                                progress.progress((idx + 1) / len(df_upload))
+                            def on_chunk(results_df, totals):
+                                if preview_rows[0] < STREAM_PREVIEW_ROWS:
+                                    preview_frames.append(results_df.head(STREAM_PREVIEW_ROWS - preview_rows[0]))
+                                    preview_rows[0] += len(preview_frames[-1])
+                                progress.progress(min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0))
                             
+                            # Scored rows go to a temporary file chunk by chunk instead of a list of dicts
+                            with tempfile.TemporaryFile(mode="w+", newline="", encoding="utf-8") as output:
+                                totals = scoring.score_csv_stream(model, vectorizer, uploaded_file, output, on_chunk=on_chunk,
+                                                                  cache=get_prediction_cache(), scorer=batch_scorer)
+                                output.seek(0)
+                                csv_data = output.read()
                             progress.empty()
                             
-                            results_df = pd.DataFrame(results)
                             st.markdown("### 📊 Batch Analysis Results")
-                            st.dataframe(results_df, use_container_width=True)
+                            st.caption(cache_stats_caption())
+                            if preview_frames:
+                                st.dataframe(pd.concat(preview_frames, ignore_index=True), use_container_width=True)
+                            if totals["rows"] > STREAM_PREVIEW_ROWS:
+                                st.caption(f"Showing the first {STREAM_PREVIEW_ROWS:,} of {totals['rows']:,} rows. Download the results for the full table.")
                             
                             # Summary stats
                             col1, col2, col3 = st.columns(3)
                             with col1:
-                                flagged = len(results_df[results_df['Status'] == 'Flagged'])
-                                st.metric("Flagged Messages", flagged)
+                                st.metric("Flagged Messages", totals["flagged"])
                             with col2:
-                                safe = len(results_df[results_df['Status'] == 'Safe'])
-                                st.metric("Safe Messages", safe)
+                                st.metric("Safe Messages", totals["safe"])
                             with col3:
-                                avg_severity = results_df['Severity'].mean()
+                                avg_severity = totals["severity_sum"] / totals["rows"] if totals["rows"] else float('nan')
                                 st.metric("Avg Severity", f"{avg_severity:.1f}")
                             
                             # Download results
-                            csv_data = results_df.to_csv(index=False)
                             st.download_button(
                                 "📥 Download Results",
                                 csv_data,
@@ -854,29 +962,9 @@ def analyze_page():
             if st.button("🔍 Analyze All Messages", use_container_width=True, key="batch_text"):
                 if batch_input.strip():
                     messages = [msg.strip() for msg in batch_input.split('\n') if msg.strip()]
-                    results = []
-                    progress = st.progress(0)
-                    
-                    for idx, message in enumerate(messages):
-                        vect_input = vectorizer.transform([message])
-                        prediction = model.predict(vect_input)[0]
-                        prediction_proba = np.max(model.predict_proba(vect_input)) * 100
-                        severity = calculate_severity(prediction, prediction_proba, message)
-                        
-                        results.append({
-                            'Message': message[:50] + '...' if len(message) > 50 else message,
-                            'Classification': prediction.replace("_", " ").title(),
-                            'Confidence': f"{prediction_proba:.1f}%",
-                            'Severity': severity,
-                            'Status': 'Safe' if prediction.lower() == 'not_cyberbullying' else 'Flagged'
-                        })
-                        
-                        progress.progress((idx + 1) / len(messages))
-                    
-                    progress.empty()
-                    
-                    results_df = pd.DataFrame(results)
+                    results_df = score_messages_frame(messages, scorer=batch_scorer)
                     st.markdown("### 📊 Batch Analysis Results")
+                    st.caption(cache_stats_caption())
                     st.dataframe(results_df, use_container_width=True)
                     
                     col1, col2, col3 = st.columns(3)
@@ -892,6 +980,90 @@ def analyze_page():
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+# Dashboard charts, rendered to PNG and cached per chart and store data version,
+# so reruns with unchanged data skip both the queries and matplotlib
+CHART_COLORS = ['#667eea', '#764ba2', '#f093fb', '#f59e0b', '#10b981', '#ef4444']
+# Same resolution st.pyplot uses, for high-DPI screens
+CHART_DPI = 200
+
+def type_pie_figure(counts):
+    fig_pie, ax_pie = plt.subplots(figsize=(8, 6), facecolor='white')
+    wedges, texts, autotexts = ax_pie.pie(
+        counts.values, 
+        labels=[label.replace("_", " ").title() for label in counts.index],
+        autopct='%1.1f%%',
+        colors=CHART_COLORS[:len(counts)],
+        startangle=90,
+        textprops={'fontsize': 11, 'weight': 'bold'},
+        explode=[0.05] * len(counts)
+    )
+    ax_pie.set_title("Type Distribution", fontsize=15, weight='bold', pad=20, color='#1e293b')
+    for autotext in autotexts:
+        autotext.set_color('white')
+    return fig_pie
+
+def type_bar_figure(counts):
+    fig_bar, ax_bar = plt.subplots(figsize=(8, 6), facecolor='white')
+    bars = ax_bar.bar(
+        range(len(counts)), 
+        counts.values,
+        color=CHART_COLORS[:len(counts)],
+        edgecolor='white',
+        linewidth=2.5
+    )
+    ax_bar.set_xticks(range(len(counts)))
+    ax_bar.set_xticklabels([label.replace("_", " ").title() for label in counts.index], 
+                           rotation=45, ha='right', fontsize=10, weight='600')
+    ax_bar.set_ylabel("Count", fontsize=12, weight='bold', color='#1e293b')
+    ax_bar.set_title("Count by Type", fontsize=15, weight='bold', pad=20, color='#1e293b')
+    ax_bar.grid(axis='y', alpha=0.2, linestyle='--', linewidth=1)
+    ax_bar.set_facecolor('#f8fafc')
+    ax_bar.spines['top'].set_visible(False)
+    ax_bar.spines['right'].set_visible(False)
+    
+    for bar in bars:
+        height = bar.get_height()
+        ax_bar.text(bar.get_x() + bar.get_width()/2., height,
+                   f'{int(height)}',
+                   ha='center', va='bottom', fontsize=11, weight='bold', color='#1e293b')
+    return fig_bar
+
+def timeline_figure(df_timeline):
+    df_timeline['Date'] = pd.to_datetime(df_timeline['Date']).dt.date
+    fig_timeline, ax_timeline = plt.subplots(figsize=(12, 5), facecolor='white')
+    ax_timeline.plot(df_timeline['Date'], df_timeline['Count'], 
+                   marker='o', linewidth=2.5, markersize=8, 
+                   color='#667eea')
+    ax_timeline.fill_between(df_timeline['Date'], df_timeline['Count'], 
+                            alpha=0.3, color='#667eea')
+    ax_timeline.set_xlabel("Date", fontsize=12, weight='bold', color='#1e293b')
+    ax_timeline.set_ylabel("Messages Flagged", fontsize=12, weight='bold', color='#1e293b')
+    ax_timeline.set_title("Flagged Messages Over Time", fontsize=15, weight='bold', pad=20, color='#1e293b')
+    ax_timeline.grid(alpha=0.2, linestyle='--')
+    ax_timeline.set_facecolor('#f8fafc')
+    plt.setp(ax_timeline.get_xticklabels(), rotation=45, ha='right')
+    return fig_timeline
+
+# PNG bytes of one dashboard chart, or None when there is nothing to plot
+@st.cache_data(max_entries=16, show_spinner=False)
+def chart_png(kind, data_version):
+    store = get_store()
+    with metrics.span("chart_render"):
+        if kind == "timeline":
+            df_timeline = store.daily_counts()
+            if len(df_timeline) == 0:
+                return None
+            fig = timeline_figure(df_timeline)
+        elif kind == "type_pie":
+            fig = type_pie_figure(store.type_counts())
+        else:
+            fig = type_bar_figure(store.type_counts())
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", dpi=CHART_DPI, bbox_inches="tight", facecolor=fig.get_facecolor())
+        plt.close(fig)
+    return buffer.getvalue()
+
 # DASHBOARD PAGE
 def dashboard_page():
     st.markdown('<div class="main-container">', unsafe_allow_html=True)
@@ -899,180 +1071,135 @@ def dashboard_page():
     st.markdown("# 📊 Analytics Dashboard")
     st.markdown("Real-time insights and comprehensive analytics of detected cyberbullying content.")
     
-    try:
-        df = pd.read_csv("flagged_messages.csv", names=["Message", "Type", "Confidence", "Severity", "Timestamp"])
+    store = get_synced_store()
+    total = store.total()
+    
+    if total > 0:
+        severity_counts = store.severity_counts()
+
+        # Key Metrics
+        st.markdown("### 📈 Key Metrics")
+        col1, col2, col3, col4 = st.columns(4)
         
-        if len(df) > 0:
-            df['Severity'] = pd.to_numeric(df['Severity'], errors='coerce')
-            df['Timestamp'] = pd.to_datetime(df['Timestamp'], errors='coerce')
-            
-            # Key Metrics
-            st.markdown("### 📈 Key Metrics")
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                st.markdown(f"""
-                <div class="stat-card">
-                    <div class="stat-number">{len(df)}</div>
-                    <div class="stat-label">Total Flagged</div>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col2:
-                critical = len(df[df['Severity'] >= 80])
-                st.markdown(f"""
-                <div class="stat-card" style="background: linear-gradient(135deg, #ef4444 0%, #dc2626 100%);">
-                    <div class="stat-number">{critical}</div>
-                    <div class="stat-label">Critical Cases</div>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col3:
-                avg_severity = df['Severity'].mean()
-                st.markdown(f"""
-                <div class="stat-card" style="background: linear-gradient(135deg, #f59e0b 0%, #f97316 100%);">
-                    <div class="stat-number">{avg_severity:.1f}</div>
-                    <div class="stat-label">Avg Severity</div>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col4:
-                today = datetime.now().date()
-                today_count = len(df[df['Timestamp'].dt.date == today])
-                st.markdown(f"""
-                <div class="stat-card" style="background: linear-gradient(135deg, #3b82f6 0%, #2563eb 100%);">
-                    <div class="stat-number">{today_count}</div>
-                    <div class="stat-label">Today</div>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            st.markdown("---")
-            
-            # Charts
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.markdown("#### 📊 Distribution by Type")
-                counts = df["Type"].value_counts()
-                fig_pie, ax_pie = plt.subplots(figsize=(8, 6), facecolor='white')
-                colors = ['#667eea', '#764ba2', '#f093fb', '#f59e0b', '#10b981', '#ef4444']
-                wedges, texts, autotexts = ax_pie.pie(
-                    counts.values, 
-                    labels=[label.replace("_", " ").title() for label in counts.index],
-                    autopct='%1.1f%%',
-                    colors=colors[:len(counts)],
-                    startangle=90,
-                    textprops={'fontsize': 11, 'weight': 'bold'},
-                    explode=[0.05] * len(counts)
-                )
-                ax_pie.set_title("Type Distribution", fontsize=15, weight='bold', pad=20, color='#1e293b')
-                for autotext in autotexts:
-                    autotext.set_color('white')
-                plt.tight_layout()
-                st.pyplot(fig_pie)
-                plt.close()
-            
-            with col2:
-                st.markdown("#### 📊 Flagged Messages by Type")
-                fig_bar, ax_bar = plt.subplots(figsize=(8, 6), facecolor='white')
-                bars = ax_bar.bar(
-                    range(len(counts)), 
-                    counts.values,
-                    color=colors[:len(counts)],
-                    edgecolor='white',
-                    linewidth=2.5
-                )
-                ax_bar.set_xticks(range(len(counts)))
-                ax_bar.set_xticklabels([label.replace("_", " ").title() for label in counts.index], 
-                                       rotation=45, ha='right', fontsize=10, weight='600')
-                ax_bar.set_ylabel("Count", fontsize=12, weight='bold', color='#1e293b')
-                ax_bar.set_title("Count by Type", fontsize=15, weight='bold', pad=20, color='#1e293b')
-                ax_bar.grid(axis='y', alpha=0.2, linestyle='--', linewidth=1)
-                ax_bar.set_facecolor('#f8fafc')
-                ax_bar.spines['top'].set_visible(False)
-                ax_bar.spines['right'].set_visible(False)
-                
-                for bar in bars:
-                    height = bar.get_height()
-                    ax_bar.text(bar.get_x() + bar.get_width()/2., height,
-                               f'{int(height)}',
-                               ha='center', va='bottom', fontsize=11, weight='bold', color='#1e293b')
-                
-                plt.tight_layout()
-                st.pyplot(fig_bar)
-                plt.close()
-            
-            # Severity Distribution
-            st.markdown("#### 🎯 Severity Distribution")
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                low = len(df[df['Severity'] < 40])
-                st.markdown(f"""
-                <div class="metric-card" style="border-left: 4px solid #3b82f6;">
-                    <div style='font-size: 2.5em; font-weight: 700; color: #3b82f6; text-align: center;'>{low}</div>
-                    <div style='font-size: 1em; color: #64748b; text-align: center;'>🔵 Low Risk</div>
-                    <div style='font-size: 0.85em; color: #94a3b8; text-align: center; margin-top: 8px;'>
-                        {(low/len(df)*100):.1f}% of total
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col2:
-                medium = len(df[(df['Severity'] >= 40) & (df['Severity'] < 80)])
-                st.markdown(f"""
-                <div class="metric-card" style="border-left: 4px solid #f59e0b;">
-                    <div style='font-size: 2.5em; font-weight: 700; color: #f59e0b; text-align: center;'>{medium}</div>
-                    <div style='font-size: 1em; color: #64748b; text-align: center;'>🟡 Medium Risk</div>
-                    <div style='font-size: 0.85em; color: #94a3b8; text-align: center; margin-top: 8px;'>
-                        {(medium/len(df)*100):.1f}% of total
-                    </div>
+        with col1:
+            st.markdown(f"""
+            <div class="stat-card">
+                <div class="stat-number">{total}</div>
+                <div class="stat-label">Total Flagged</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col2:
+            critical = severity_counts["high"]
+            st.markdown(f"""
+            <div class="stat-card" style="background: linear-gradient(135deg, #ef4444 0%, #dc2626 100%);">
+                <div class="stat-number">{critical}</div>
+                <div class="stat-label">Critical Cases</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col3:
+            avg_severity = store.average_severity()
+            avg_severity = float('nan') if avg_severity is None else avg_severity
+            st.markdown(f"""
+            <div class="stat-card" style="background: linear-gradient(135deg, #f59e0b 0%, #f97316 100%);">
+                <div class="stat-number">{avg_severity:.1f}</div>
+                <div class="stat-label">Avg Severity</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col4:
+            today_count = store.day_count(datetime.now().date())
+            st.markdown(f"""
+            <div class="stat-card" style="background: linear-gradient(135deg, #3b82f6 0%, #2563eb 100%);">
+                <div class="stat-number">{today_count}</div>
+                <div class="stat-label">Today</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        st.markdown("---")
+        
+        # Charts (cached PNGs, re-rendered only when the store's data changes)
+        data_version = store.data_version()
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.markdown("#### 📊 Distribution by Type")
+            st.image(chart_png("type_pie", data_version), use_container_width=True)
+        
+        with col2:
+            st.markdown("#### 📊 Flagged Messages by Type")
+            st.image(chart_png("type_bar", data_version), use_container_width=True)
+        
+        # Severity Distribution
+        st.markdown("#### 🎯 Severity Distribution")
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            low = severity_counts["low"]
+            st.markdown(f"""
+            <div class="metric-card" style="border-left: 4px solid #3b82f6;">
+                <div style='font-size: 2.5em; font-weight: 700; color: #3b82f6; text-align: center;'>{low}</div>
+                <div style='font-size: 1em; color: #64748b; text-align: center;'>🔵 Low Risk</div>
+                <div style='font-size: 0.85em; color: #94a3b8; text-align: center; margin-top: 8px;'>
+                    {(low/total*100):.1f}% of total
                 </div>
-                """, unsafe_allow_html=True)
-            
-            with col3:
-                high = len(df[df['Severity'] >= 80])
-                st.markdown(f"""
-                <div class="metric-card" style="border-left: 4px solid #ef4444;">
-                    <div style='font-size: 2.5em; font-weight: 700; color: #ef4444; text-align: center;'>{high}</div>
-                    <div style='font-size: 1em; color: #64748b; text-align: center;'>🔴 High Risk</div>
-                    <div style='font-size: 0.85em; color: #94a3b8; text-align: center; margin-top: 8px;'>
-                        {(high/len(df)*100):.1f}% of total
-                    </div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col2:
+            medium = severity_counts["medium"]
+            st.markdown(f"""
+            <div class="metric-card" style="border-left: 4px solid #f59e0b;">
+                <div style='font-size: 2.5em; font-weight: 700; color: #f59e0b; text-align: center;'>{medium}</div>
+                <div style='font-size: 1em; color: #64748b; text-align: center;'>🟡 Medium Risk</div>
+                <div style='font-size: 0.85em; color: #94a3b8; text-align: center; margin-top: 8px;'>
+                    {(medium/total*100):.1f}% of total
                 </div>
-                """, unsafe_allow_html=True)
-            
-            # Timeline Analysis
-            st.markdown("#### 📅 Timeline Analysis")
-            if not df['Timestamp'].isna().all():
-                df_timeline = df.groupby(df['Timestamp'].dt.date).size().reset_index()
-                df_timeline.columns = ['Date', 'Count']
-                
-                fig_timeline, ax_timeline = plt.subplots(figsize=(12, 5), facecolor='white')
-                ax_timeline.plot(df_timeline['Date'], df_timeline['Count'], 
-                               marker='o', linewidth=2.5, markersize=8, 
-                               color='#667eea')
-                ax_timeline.fill_between(df_timeline['Date'], df_timeline['Count'], 
-                                        alpha=0.3, color='#667eea')
-                ax_timeline.set_xlabel("Date", fontsize=12, weight='bold', color='#1e293b')
-                ax_timeline.set_ylabel("Messages Flagged", fontsize=12, weight='bold', color='#1e293b')
-                ax_timeline.set_title("Flagged Messages Over Time", fontsize=15, weight='bold', pad=20, color='#1e293b')
-                ax_timeline.grid(alpha=0.2, linestyle='--')
-                ax_timeline.set_facecolor('#f8fafc')
-                plt.xticks(rotation=45, ha='right')
-                plt.tight_layout()
-                st.pyplot(fig_timeline)
-                plt.close()
+            </div>
+            """, unsafe_allow_html=True)
         
-        else:
-            st.markdown("""
-            <div class="alert-box alert-info">
-                <h4 style='margin: 0 0 8px 0;'>📊 No Data Available</h4>
-                <p style='margin: 0;'>Start analyzing messages to see analytics and insights.</p>
+        with col3:
+            high = severity_counts["high"]
+            st.markdown(f"""
+            <div class="metric-card" style="border-left: 4px solid #ef4444;">
+                <div style='font-size: 2.5em; font-weight: 700; color: #ef4444; text-align: center;'>{high}</div>
+                <div style='font-size: 1em; color: #64748b; text-align: center;'>🔴 High Risk</div>
+                <div style='font-size: 0.85em; color: #94a3b8; text-align: center; margin-top: 8px;'>
+                    {(high/total*100):.1f}% of total
+                </div>
             </div>
             """, unsafe_allow_html=True)
+        
+        # Near-duplicate clusters: the same message (or close variants) flagged repeatedly
+        st.markdown("#### 🧬 Near-Duplicate Campaigns")
+        clusters = store.cluster_summary()
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Distinct Messages", f"{clusters['clusters']:,}")
+        with col2:
+            st.metric("Repeated Clusters", f"{clusters['duplicate_clusters']:,}")
+        with col3:
+            share = clusters['duplicate_flags'] / clusters['clustered'] * 100 if clusters['clustered'] else 0.0
+            st.metric("Flags in Repeated Clusters", f"{clusters['duplicate_flags']:,}", f"{share:.1f}% of clustered",
+                      delta_color="off")
+        top = store.top_clusters(10)
+        if len(top):
+            top['Representative'] = top['Representative'].where(top['Representative'].str.len() <= 80,
+                                                                top['Representative'].str.slice(0, 80) + '...')
+            top['Type'] = top['Type'].fillna("").str.replace("_", " ").str.title()
+            st.dataframe(top, use_container_width=True, hide_index=True)
+        else:
+            st.caption("No message has been flagged more than once yet.")
+
+        # Timeline Analysis (below the fold, rendered only when switched on)
+        st.markdown("#### 📅 Timeline Analysis")
+        if st.toggle("Show timeline", key="show_timeline"):
+            timeline = chart_png("timeline", data_version)
+            if timeline is not None:
+                st.image(timeline, use_container_width=True)
     
-    except FileNotFoundError:
+    else:
         st.markdown("""
         <div class="alert-box alert-info">
             <h4 style='margin: 0 0 8px 0;'>📊 No Data Available</h4>
@@ -1089,130 +1216,129 @@ def reports_page():
     st.markdown("# 📝 Reports & History")
     st.markdown("View, filter, and export flagged message history.")
     
-    try:
-        df = pd.read_csv("flagged_messages.csv", names=["Message", "Type", "Confidence", "Severity", "Timestamp"])
+    store = get_synced_store()
+    
+    if store.total() > 0:
+        # Filters
+        st.markdown("### 🔍 Filters")
+        col1, col2, col3 = st.columns(3)
         
-        if len(df) > 0:
-            df['Severity'] = pd.to_numeric(df['Severity'], errors='coerce')
-            df['Timestamp'] = pd.to_datetime(df['Timestamp'], errors='coerce')
-            
-            # Filters
-            st.markdown("### 🔍 Filters")
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                severity_filter = st.selectbox(
-                    "Severity Level:",
-                    ["All", "Low (0-40)", "Medium (40-80)", "High (80-100)"]
-                )
-            
-            with col2:
-                type_filter = st.selectbox(
-                    "Type:",
-                    ["All"] + list(df['Type'].unique())
-                )
-            
-            with col3:
-                date_range = st.selectbox(
-                    "Date Range:",
-                    ["All Time", "Last 7 Days", "Last 30 Days", "Today"]
-                )
-            
-            # Apply filters
-            filtered_df = df.copy()
-            
-            if severity_filter != "All":
-                if severity_filter == "Low (0-40)":
-                    filtered_df = filtered_df[filtered_df['Severity'] < 40]
-                elif severity_filter == "Medium (40-80)":
-                    filtered_df = filtered_df[(filtered_df['Severity'] >= 40) & (filtered_df['Severity'] < 80)]
-                else:
-                    filtered_df = filtered_df[filtered_df['Severity'] >= 80]
-            
-            if type_filter != "All":
-                filtered_df = filtered_df[filtered_df['Type'] == type_filter]
-            
-            if date_range != "All Time":
-                today = datetime.now()
-                if date_range == "Today":
-                    filtered_df = filtered_df[filtered_df['Timestamp'].dt.date == today.date()]
-                elif date_range == "Last 7 Days":
-                    filtered_df = filtered_df[filtered_df['Timestamp'] >= (today - timedelta(days=7))]
-                else:
-                    filtered_df = filtered_df[filtered_df['Timestamp'] >= (today - timedelta(days=30))]
-            
-            # Display results
-            st.markdown(f"### 📋 Results ({len(filtered_df)} messages)")
-            
-            # Format for display
-            display_df = filtered_df.copy()
-            display_df['Message'] = display_df['Message'].apply(lambda x: x[:80] + '...' if len(str(x)) > 80 else x)
-            display_df['Type'] = display_df['Type'].apply(lambda x: x.replace("_", " ").title())
-            display_df['Timestamp'] = display_df['Timestamp'].dt.strftime('%Y-%m-%d %H:%M')
-            
-            st.dataframe(
-                display_df[['Timestamp', 'Message', 'Type', 'Confidence', 'Severity']],
-                use_container_width=True,
-                height=400
+        with col1:
+            severity_filter = st.selectbox(
+                "Severity Level:",
+                ["All", "Low (0-40)", "Medium (40-80)", "High (80-100)"]
             )
-            
-            # Export options
-            st.markdown("### 📥 Export Data")
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                csv_export = filtered_df.to_csv(index=False)
-                st.download_button(
-                    "📥 Download CSV",
-                    csv_export,
-                    "flagged_messages_export.csv",
-                    "text/csv",
-                    use_container_width=True
-                )
-            with col2:
-                # Generate summary report
-                summary = f"""
+        
+        with col2:
+            type_filter = st.selectbox(
+                "Type:",
+                ["All"] + store.types()
+            )
+        
+        with col3:
+            date_range = st.selectbox(
+                "Date Range:",
+                ["All Time", "Last 7 Days", "Last 30 Days", "Today"]
+            )
+        
+        # Only the visible page is read; filters, counts and the summary are
+        # pushed down to the store
+        filters = report_filters(severity_filter, type_filter, date_range)
+        
+        # Full-text search over live and archived history, best match first
+        search_text = ""
+        if store.searchable:
+            search_text = st.text_input("🔎 Search messages:", placeholder="Words every result must contain").strip()
+        if search_text:
+            total = store.search_count(search_text, **filters)
+        else:
+            total = store.count(**filters)
+        
+        # Display results
+        if search_text:
+            st.markdown(f"### 📋 Results ({total} messages matching \"{search_text}\")")
+        else:
+            st.markdown(f"### 📋 Results ({total} messages)")
+        
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            page_size = st.selectbox("Rows per page:", REPORT_PAGE_SIZES, index=1)
+        pages = max(-(-total // page_size), 1)
+        with col2:
+            page = st.number_input(f"Page (of {pages}):", min_value=1, max_value=pages, value=1, step=1)
+        
+        if search_text:
+            page_df = search_page(search_text, **filters, limit=page_size, offset=(page - 1) * page_size,
+                                  data_version=store.data_version())
+        else:
+            page_df = store.query_page(**filters, limit=page_size, offset=(page - 1) * page_size)
+        st.dataframe(
+            format_report_page(page_df)[['Timestamp', 'Message', 'Type', 'Confidence', 'Severity']],
+            use_container_width=True,
+            height=400
+        )
+        
+        # Export options
+        st.markdown("### 📥 Export Data")
+        if search_text:
+            st.caption("Exports and the summary cover the filters above, not the search.")
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            # Exports are only generated when asked for, streamed chunk by
+            # chunk into a temporary file rather than built as one string
+            export_format = st.selectbox("Export format:", available_formats())
+            if st.button("📦 Prepare Export", use_container_width=True):
+                with tempfile.TemporaryFile(buffering=0) as export_file:
+                    with st.spinner(f"Exporting {total:,} messages..."):
+                        write_export(store, export_file, export_format, **filters)
+                    st.download_button(
+                        f"📥 Download {export_format.upper()}",
+                        export_file,
+                        export_filename(export_format),
+                        EXPORT_FORMATS[export_format],
+                        on_click="ignore",
+                        use_container_width=True
+                    )
+        with col2:
+            # Generate summary report
+            report = store.summary(**filters)
+            severity_counts = report["severity_counts"]
+            average_severity = report["average_severity"] if report["average_severity"] is not None else float('nan')
+            summary = f"""
 CYBERGUARD AI - SUMMARY REPORT
 Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}
 
 OVERVIEW:
-- Total Messages: {len(filtered_df)}
-- Average Severity: {filtered_df['Severity'].mean():.1f}
-- Critical Cases: {len(filtered_df[filtered_df['Severity'] >= 80])}
+- Total Messages: {report['count']}
+- Average Severity: {average_severity:.1f}
+- Critical Cases: {severity_counts['high']}
 
 BY TYPE:
-{filtered_df['Type'].value_counts().to_string()}
+{report['type_counts'].rename_axis('Type').to_string()}
 
 BY SEVERITY:
-- Low: {len(filtered_df[filtered_df['Severity'] < 40])}
-- Medium: {len(filtered_df[(filtered_df['Severity'] >= 40) & (filtered_df['Severity'] < 80)])}
-- High: {len(filtered_df[filtered_df['Severity'] >= 80])}
-                """
-                
-                st.download_button(
-                    "📊 Download Summary",
-                    summary,
-                    "summary_report.txt",
-                    "text/plain",
-                    use_container_width=True
-                )
+- Low: {severity_counts['low']}
+- Medium: {severity_counts['medium']}
+- High: {severity_counts['high']}
+            """
             
-            with col3:
-                if st.button("🗑️ Clear All Data", use_container_width=True):
-                    if st.checkbox("Confirm deletion"):
-                        open("flagged_messages.csv", 'w').close()
-                        st.success("All data cleared!")
-                        st.rerun()
+            st.download_button(
+                "📊 Download Summary",
+                summary,
+                "summary_report.txt",
+                "text/plain",
+                use_container_width=True
+            )
         
-        else:
-            st.markdown("""
-            <div class="alert-box alert-info">
-                <h4 style='margin: 0 0 8px 0;'>📝 No Reports Available</h4>
-                <p style='margin: 0;'>Start analyzing messages to generate reports.</p>
-            </div>
-            """, unsafe_allow_html=True)
+        with col3:
+            if st.button("🗑️ Clear All Data", use_container_width=True):
+                if st.checkbox("Confirm deletion"):
+                    store.clear()
+                    st.success("All data cleared!")
+                    st.rerun()
     
-    except FileNotFoundError:
+    else:
         st.markdown("""
         <div class="alert-box alert-info">
             <h4 style='margin: 0 0 8px 0;'>📝 No Reports Available</h4>
@@ -1283,7 +1409,7 @@ def about_page():
         - Severity Scoring
         - Analytics Dashboard
         - Export Reports
-        - API Access (Coming Soon)
+        - REST API Access (`python api.py`)
         """)
     
     st.markdown('</div>', unsafe_allow_html=True)
@@ -1305,6 +1431,7 @@ def main():
         about_page()
     
     render_footer()
+    render_admin_panel()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import scipy.sparse as sp
+
+# Compact model artifact: the fitted TF-IDF vocabulary, IDF weights and the
+# linear model's coefficients exported as flat .npy arrays in one directory.
+#
+#   python artifact.py --output model_artifact
+#
+# Exporting also checks the artifact against the original estimator and fails
+# unless the TF-IDF matrices, probabilities and labels are identical.
+#
+# Loading it needs only numpy and scipy (no scikit-learn import, no unpickling),
+# and every array is memory-mapped read-only, so cold start takes milliseconds
+# and worker processes share the same physical pages through the page cache.
+# The vocabulary is stored as a sorted array of terms with their feature
+# columns; each process turns it into a term -> column dict on load (about a
+# millisecond for the 5,000-term vocabulary), which tokenization looks up.
+ARTIFACT_VERSION = 1
+
+# Vectorizer settings the compact transform reproduces exactly
+SUPPORTED_VECTORIZER = {"analyzer": "word", "ngram_range": (1, 1), "stop_words": None, "strip_accents": None,
+                        "preprocessor": None, "tokenizer": None, "input": "content"}
+
+def _vectorizer_config(vectorizer):
+    params = vectorizer.get_params()
+    for name, expected in SUPPORTED_VECTORIZER.items():
+        value = params.get(name)
+        if (tuple(value) if isinstance(value, list) else value) != expected:
+            raise ValueError(f"Compact artifact does not support {name}={value!r}")
+    if re.compile(params["token_pattern"]).groups > 1:
+        raise ValueError("Compact artifact does not support token patterns with several groups")
+    return {
+        "lowercase": bool(params["lowercase"]),
+        "token_pattern": params["token_pattern"],
+        "binary": bool(params["binary"]),
+        "sublinear_tf": bool(params.get("sublinear_tf", False)),
+        "use_idf": bool(params.get("use_idf", False)),
+        "norm": params.get("norm"),
+        "dtype": np.dtype(params["dtype"]).name,
+    }
+
+def _link(model):
+    if len(model.classes_) <= 2:
+        return "logistic"
+    if getattr(model, "multi_class", "auto") == "ovr" or getattr(model, "solver", None) == "liblinear":
+        return "ovr"
+    return "softmax"
+
+# Write the arrays for a fitted (model, vectorizer) pair into `directory`.
+# `source_version` identifies the files they came from (see is_current).
+def export_artifact(model, vectorizer, directory, source_version=None):
+    config = _vectorizer_config(vectorizer)
+    if not hasattr(model, "coef_") or not hasattr(model, "intercept_"):
+        raise ValueError(f"Compact artifact needs a linear model, got {type(model).__name__}")
+
+    vocabulary = sorted(vectorizer.vocabulary_.items())
+    arrays = {
+        "terms": np.array([term for term, _ in vocabulary], dtype=str),
+        "columns": np.array([column for _, column in vocabulary], dtype=np.int32),
+        "coef": np.ascontiguousarray(model.coef_, dtype=np.float64),
+        "intercept": np.asarray(model.intercept_, dtype=np.float64),
+        "classes": np.asarray(model.classes_).astype(str),
+    }
+    if config["use_idf"]:
+        arrays["idf"] = np.asarray(vectorizer.idf_, dtype=np.float64)
+    config.update({"artifact_version": ARTIFACT_VERSION, "source_version": source_version, "link": _link(model),
+                   "n_features": int(arrays["coef"].shape[1])})
+
+    # Build in a scratch directory and rename it into place, so readers never
+    # see a half-written artifact
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".artifact-", dir=parent)
+    os.chmod(tmp_dir, 0o755)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), array, allow_pickle=False)
+        with open(os.path.join(tmp_dir, "config.json"), "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory, ignore_errors=True)
+        os.rename(tmp_dir, directory)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        # Another process may have exported the same artifact concurrently
+        if not is_current(directory, source_version):
+            raise
+
+def read_config(directory):
+    try:
+        with open(os.path.join(directory, "config.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# True when `directory` holds an artifact exported from `source_version`
+def is_current(directory, source_version):
+    config = read_config(directory)
+    return (config is not None and config.get("artifact_version") == ARTIFACT_VERSION
+            and config.get("source_version") == source_version)
+
+def _load(directory, name, mmap):
+    return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r" if mmap else None, allow_pickle=False)
+
+# Returns (model, vectorizer) with the transform/predict_proba/classes_
+# interface scoring.score_batch uses
+def load_artifact(directory, mmap=True):
+    config = read_config(directory)
+    if config is None or config.get("artifact_version") != ARTIFACT_VERSION:
+        raise ValueError(f"No compact model artifact in {directory}")
+    vectorizer = CompactVectorizer(config, _load(directory, "terms", mmap), _load(directory, "columns", mmap),
+                                   _load(directory, "idf", mmap) if config["use_idf"] else None)
+    model = CompactLinearModel(config["link"], _load(directory, "coef", mmap), _load(directory, "intercept", mmap),
+                               _load(directory, "classes", False).astype(object))
+    return model, vectorizer
+
+# TF-IDF transform over the exported arrays, matching TfidfVectorizer.transform
+class CompactVectorizer:
+    def __init__(self, config, terms, columns, idf=None):
+        self.config = config
+        self.terms = terms
+        self.columns = columns
+        self.idf_ = idf
+        self.dtype = np.dtype(config["dtype"])
+        self.n_features = config["n_features"]
+        self._find = re.compile(config["token_pattern"]).findall
+        self.vocabulary_ = dict(zip(terms.tolist(), columns.tolist()))
+
+    def _term_counts(self, raw_documents):
+        if isinstance(raw_documents, str):
+            raise ValueError("Iterable over raw text documents expected, string object received.")
+        lowercase = self.config["lowercase"]
+        lookup = self.vocabulary_.get
+        columns, lengths = [], []
+        for doc in raw_documents:
+            if lowercase:
+                doc = doc.lower()
+            doc_columns = [column for column in map(lookup, self._find(doc)) if column is not None]
+            columns.extend(doc_columns)
+            lengths.append(len(doc_columns))
+
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        columns = np.array(columns, dtype=np.int32)
+        # COO -> CSR sums repeated tokens and leaves the indices sorted
+        counts = sp.csr_matrix((np.ones(len(columns), dtype=self.dtype), (rows, columns)),
+                               shape=(len(lengths), self.n_features))
+        counts.sort_indices()
+        return counts
+
+    def transform(self, raw_documents):
+        X = self._term_counts(raw_documents)
+        if self.config["binary"]:
+            X.data.fill(1)
+        if self.config["sublinear_tf"]:
+            np.log(X.data, X.data)
+            X.data += 1
+        if self.idf_ is not None:
+            X.data *= self.idf_[X.indices]
+        norm = self.config["norm"]
+        if norm is not None:
+            values = np.abs(X.data) if norm == "l1" else X.data * X.data
+            row_ids = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+            norms = np.bincount(row_ids, weights=values, minlength=X.shape[0])
+            if norm == "l2":
+                norms = np.sqrt(norms)
+            norms[norms == 0.0] = 1.0
+            X.data /= norms[row_ids]
+        return X
+
+# Class probabilities of a linear classifier: one sparse-dense product plus
+# the link function, with the same operations and order as scikit-learn's
+# LogisticRegression.predict_proba, so the results are bit-identical
+def linear_proba(link, coef, intercept, X):
+    scores = np.asarray(X @ coef.T) + intercept
+    if link == "softmax":
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+    from scipy.special import expit
+    expit(scores, out=scores)
+    if link == "logistic":
+        scores = scores.ravel()
+        return np.vstack([1 - scores, scores]).T
+    scores /= scores.sum(axis=1, keepdims=True)
+    return scores
+
+# Linear classifier over the exported coefficients, matching the original
+# estimator's predict_proba
+class CompactLinearModel:
+    def __init__(self, link, coef, intercept, classes):
+        self.link = link
+        self.coef_ = coef
+        self.intercept_ = intercept
+        self.classes_ = classes
+
+    def predict_proba(self, X):
+        return linear_proba(self.link, self.coef_, self.intercept_, X)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+# Models LinearScorer can score from their fitted arrays
+LINEAR_MODELS = ("CompactLinearModel", "LogisticRegression", "LogisticRegressionCV")
+
+def supports_linear_scoring(model):
+    return type(model).__name__ in LINEAR_MODELS
+
+# Fast path for scoring: label and probability straight from the fitted
+# coefficients, intercepts and classes_, without the estimator's per-call
+# input validation (which dominates for single messages and small batches)
+class LinearScorer:
+    def __init__(self, model):
+        if not supports_linear_scoring(model):
+            raise ValueError(f"LinearScorer does not support {type(model).__name__}")
+        self.link = model.link if isinstance(model, CompactLinearModel) else _link(model)
+        self.coef = model.coef_
+        self.intercept = model.intercept_
+        self.classes = model.classes_
+
+    # (labels, probability of each label) for a TF-IDF matrix
+    def predict(self, X):
+        proba = linear_proba(self.link, self.coef, self.intercept, X)
+        best = proba.argmax(axis=1)
+        return self.classes[best], proba[np.arange(len(best)), best]
+
+# Compare the compact artifact and the fast path against the original
+# estimator on synthetic messages built from the vocabulary
+def check_parity(model, vectorizer, compact_model, compact_vectorizer, samples=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    terms = np.array(sorted(vectorizer.vocabulary_), dtype=object)
+    noise = np.array(["lol", "u", "!!", "123", "the", "a", "YOU", "x" * 40], dtype=object)
+    texts = ["", "   ", "I HATE you, idiot!!", "have a nice day"]
+    for length in rng.integers(1, 40, samples):
+        words = np.where(rng.random(length) < 0.8, rng.choice(terms, length), rng.choice(noise, length))
+        texts.append(" ".join(words))
+
+    expected = vectorizer.transform(texts)
+    actual = compact_vectorizer.transform(texts)
+    matrix_equal = ((expected != actual).nnz == 0 and np.array_equal(expected.indices, actual.indices)
+                    and np.array_equal(expected.indptr, actual.indptr))
+    proba = model.predict_proba(expected)
+    labels, confidences = LinearScorer(compact_model).predict(actual)
+    return {
+        "texts": len(texts),
+        "matrix_equal": bool(matrix_equal),
+        "proba_equal": bool(np.array_equal(proba, compact_model.predict_proba(actual))),
+        "labels_equal": bool(np.array_equal(labels.astype(str), model.predict(expected).astype(str))),
+        "max_confidence_diff": float(np.abs(confidences - proba.max(axis=1)).max()),
+    }
+
+def parity_ok(report):
+    return (report["matrix_equal"] and report["proba_equal"] and report["labels_equal"]
+            and report["max_confidence_diff"] == 0.0)
+
+# Export, then check the artifact against the estimator; an artifact that does
+# not match is removed again, so loaders keep using the pickles. Returns
+# whether the artifact was kept.
+def export_verified(model, vectorizer, directory, source_version=None, samples=500):
+    export_artifact(model, vectorizer, directory, source_version)
+    if parity_ok(check_parity(model, vectorizer, *load_artifact(directory), samples=samples)):
+        return True
+    shutil.rmtree(directory, ignore_errors=True)
+    return False
+
+def main(argv=None):
+    import scoring
+    from prediction_cache import file_fingerprint
+
+    parser = argparse.ArgumentParser(description="Export the model and vectorizer as a compact array artifact")
+    parser.add_argument("--model", default=scoring.MODEL_PATH)
+    parser.add_argument("--vectorizer", default=scoring.VECTORIZER_PATH)
+    parser.add_argument("--output", help="artifact directory (default: next to the model)")
+    args = parser.parse_args(argv)
+
+    output = args.output or scoring.artifact_dir_for(args.model)
+    model, vectorizer = scoring.load_models(args.model, args.vectorizer, compact=False)
+    export_artifact(model, vectorizer, output, source_version=file_fingerprint(args.model, args.vectorizer))
+    print(f"Exported {len(vectorizer.vocabulary_):,} terms and {len(model.classes_)} classes to {output}")
+
+    report = check_parity(model, vectorizer, *load_artifact(output))
+    print(json.dumps(report, indent=2))
+    if not parity_ok(report):
+        raise SystemExit("Compact artifact does not match the original model")
+
+if __name__ == "__main__":
+    main()
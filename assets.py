@@ -0,0 +1,78 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+# Lottie animations are served from memory, then from the on-disk cache, then
+# from a bundled fallback file. Network fetches only ever run on a background
+# thread and fill the caches for later renders, so rendering never waits on
+# the network. Set CYBERGUARD_OFFLINE=1 to skip fetching entirely.
+CACHE_DIR = os.path.join(".cache", "lottie")
+FETCH_TIMEOUT = 5
+RETRY_AFTER = 300
+OFFLINE = os.environ.get("CYBERGUARD_OFFLINE", "") not in ("", "0")
+
+_memory_cache = {}
+_pending = set()
+_failed_at = {}
+_lock = threading.Lock()
+
+def _cache_path(url):
+    return os.path.join(CACHE_DIR, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _fetch(url):
+    data = None
+    try:
+        r = requests.get(url, timeout=FETCH_TIMEOUT)
+        if r.status_code == 200:
+            data = r.json()
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = _cache_path(url) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, _cache_path(url))
+    except (requests.RequestException, OSError, ValueError):
+        data = None
+    with _lock:
+        _pending.discard(url)
+        if data is not None:
+            _memory_cache[url] = data
+        else:
+            _failed_at[url] = time.monotonic()
+
+def _fetch_in_background(url):
+    with _lock:
+        if url in _pending or time.monotonic() - _failed_at.get(url, -RETRY_AFTER) < RETRY_AFTER:
+            return
+        _pending.add(url)
+    threading.Thread(target=_fetch, args=(url,), name="lottie-fetch", daemon=True).start()
+
+# Load Lottie animation without blocking: returns the cached animation, or the
+# bundled fallback (possibly None) while the real one is fetched for next time.
+def load_lottie(url, fallback_path=None):
+    data = _memory_cache.get(url)
+    if data is not None:
+        return data
+    data = _read_json(_cache_path(url))
+    if data is not None:
+        with _lock:
+            _memory_cache[url] = data
+        return data
+    if not OFFLINE:
+        _fetch_in_background(url)
+    return _bundled(fallback_path) if fallback_path else None
+
+@functools.lru_cache(maxsize=None)
+def _bundled(path):
+    return _read_json(path)
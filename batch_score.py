@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+import scoring
+from scoring import get_severity_level
+
+# Offline batch scorer for nightly backfills:
+#
+#   python batch_score.py messages.csv scored.csv --chunk-size 20000 --workers 8
+#   python batch_score.py messages.jsonl scored.jsonl --resume
+#   python batch_score.py messages.parquet scored_parquet/ --id-column message_id
+#
+# Input is streamed in chunks from CSV, JSONL or Parquet. CSV and JSONL output
+# is appended chunk by chunk; Parquet output is a directory with one part file
+# per chunk. After every chunk, a checkpoint (<output>.progress.json) records
+# how far the job got, and --resume continues from there.
+
+# Model files default to the ones next to this script so cron can run it from anywhere
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl", ".parquet": "parquet"}
+
+def detect_format(path, override=None):
+    if override:
+        return override
+    if os.path.isdir(path) or path.endswith(os.sep):
+        return "parquet"
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise SystemExit(f"Cannot tell the format of {path}; pass --input-format/--output-format")
+    return fmt
+
+def read_chunks(path, fmt, columns, chunk_size):
+    if fmt == "csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+    elif fmt == "jsonl":
+        for chunk in pd.read_json(path, lines=True, chunksize=chunk_size):
+            yield chunk[columns]
+    else:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet input requires pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+
+def results_frame(chunk, text_column, id_column, predictions, confidences, severities):
+    results = pd.DataFrame()
+    if id_column:
+        results[id_column] = chunk[id_column].values
+    results["message"] = chunk[text_column].astype(str).values
+    results["classification"] = pd.Series(predictions, dtype=object).astype(str).values
+    results["confidence"] = pd.Series(confidences, dtype=float).round(2).values
+    results["severity"] = severities
+    results["severity_level"] = [get_severity_level(severity)[0] for severity in severities]
+    results["status"] = ["safe" if prediction == "not_cyberbullying" else "flagged"
+                         for prediction in results["classification"]]
+    return results
+
+class Checkpoint:
+    def __init__(self, output):
+        self.path = output.rstrip(os.sep) + ".progress.json"
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+def write_chunk(results, output, fmt, chunk_index, header):
+    if fmt == "parquet":
+        os.makedirs(output, exist_ok=True)
+        results.to_parquet(os.path.join(output, f"part-{chunk_index:06d}.parquet"), index=False)
+        return None
+    with open(output, "a", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            results.to_csv(f, index=False, header=header)
+        else:
+            results.to_json(f, orient="records", lines=True, force_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a CSV, JSONL or Parquet file of messages offline")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--input-format", choices=["csv", "jsonl", "parquet"])
+    parser.add_argument("--output-format", choices=["csv", "jsonl", "parquet"])
+    parser.add_argument("--column", default="message", help="column holding the message text")
+    parser.add_argument("--id-column", help="column copied to the output to identify rows")
+    parser.add_argument("--chunk-size", type=int, default=scoring.STREAM_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1, help="scoring processes (1 = score in-process)")
+    parser.add_argument("--cache-mb", type=float, default=64,
+                        help="prediction cache budget for in-process scoring (0 disables it)")
+    parser.add_argument("--model", default=os.path.join(HERE, scoring.MODEL_PATH))
+    parser.add_argument("--vectorizer", default=os.path.join(HERE, scoring.VECTORIZER_PATH))
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    input_format = detect_format(args.input, args.input_format)
+    output_format = detect_format(args.output, args.output_format)
+    columns = [args.column] + ([args.id_column] if args.id_column else [])
+    checkpoint = Checkpoint(args.output)
+
+    state = checkpoint.load() if args.resume else None
+    if state is not None:
+        if state["input"] != os.path.abspath(args.input):
+            raise SystemExit(f"Checkpoint {checkpoint.path} belongs to {state['input']}")
+        chunk_size = state["chunk_size"]
+        # Drop anything written after the last checkpoint
+        if output_format != "parquet" and os.path.exists(args.output):
+            with open(args.output, "r+b") as f:
+                f.truncate(state["output_bytes"])
+    else:
+        if output_format == "parquet" and os.path.isdir(args.output):
+            for name in os.listdir(args.output):
+                if name.startswith("part-") and name.endswith(".parquet"):
+                    os.remove(os.path.join(args.output, name))
+        elif os.path.exists(args.output):
+            os.remove(args.output)
+        chunk_size = args.chunk_size
+        state = {"input": os.path.abspath(args.input), "chunk_size": chunk_size,
+                 "chunks_done": 0, "rows_done": 0, "flagged": 0, "output_bytes": 0}
+
+    chunks = read_chunks(args.input, input_format, columns, chunk_size)
+    skipped = state["chunks_done"]
+    chunks = (chunk for index, chunk in enumerate(chunks) if index >= skipped)
+
+    scorer = None
+    if args.workers > 1:
+        from parallel import ParallelScorer
+        scorer = ParallelScorer(workers=args.workers, model_path=args.model, vectorizer_path=args.vectorizer)
+        scored = scorer.imap_tagged((chunk, chunk[args.column].astype(str).tolist()) for chunk in chunks)
+    else:
+        model, vectorizer = scoring.load_models(args.model, args.vectorizer)
+        cache = None
+        if args.cache_mb > 0:
+            cache = scoring.make_prediction_cache(max_bytes=int(args.cache_mb * 1024 * 1024),
+                                                  model_path=args.model, vectorizer_path=args.vectorizer)
+        scored = ((chunk, scoring.score_batch(model, vectorizer, chunk[args.column].astype(str).tolist(), cache=cache))
+                  for chunk in chunks)
+
+    started = time.perf_counter()
+    rows_this_run = 0
+    try:
+        for chunk, (predictions, confidences, severities) in scored:
+            results = results_frame(chunk, args.column, args.id_column, predictions, confidences, severities)
+            size = write_chunk(results, args.output, output_format, state["chunks_done"],
+                               header=state["rows_done"] == 0)
+            state["chunks_done"] += 1
+            state["rows_done"] += len(results)
+            state["flagged"] += int((results["status"] == "flagged").sum())
+            if size is not None:
+                state["output_bytes"] = size
+            checkpoint.save(state)
+
+            rows_this_run += len(results)
+            if not args.quiet:
+                rate = rows_this_run / max(time.perf_counter() - started, 1e-9)
+                print(f"{state['rows_done']:,} rows scored ({state['flagged']:,} flagged, {rate:,.0f} rows/s)",
+                      file=sys.stderr)
+    finally:
+        if scorer is not None:
+            scorer.close()
+
+    if not args.quiet:
+        print(f"Done: {state['rows_done']:,} rows, {state['flagged']:,} flagged -> {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
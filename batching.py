@@ -0,0 +1,94 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import scoring
+
+# Background thread that drains a queue in batches: after the first item it
+# keeps collecting for up to `max_wait` seconds or `max_batch_size` items and
+# hands the batch to _process(). close() lets the thread finish the queued
+# items and stop.
+class QueueBatcher:
+    def __init__(self, max_batch_size, max_wait, name):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _process(self, batch):
+        raise NotImplementedError
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the sentinel so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._process(self._collect(item))
+
+# Dynamic micro-batcher: concurrent callers submit single messages, a background
+# thread collects them for up to `max_wait_ms` or `max_batch_size` items and
+# scores them together, then resolves each caller's future with its own result.
+class MicroBatcher(QueueBatcher):
+    def __init__(self, score_fn, max_batch_size=64, max_wait_ms=5):
+        self.score_fn = score_fn
+        super().__init__(max_batch_size, max_wait_ms / 1000, "micro-batcher")
+
+    def submit(self, message):
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put((message, future))
+        return future
+
+    def score(self, message, timeout=None):
+        return self.submit(message).result(timeout)
+
+    def _process(self, batch):
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = self.score_fn([message for message, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+# Batcher whose results are scoring.ScoredMessage tuples
+def scoring_batcher(model, vectorizer, max_batch_size=64, max_wait_ms=5, cache=None):
+    def score_fn(messages):
+        timings = {"batch_size": len(messages)}
+        predictions, confidences, severities = scoring.score_batch(model, vectorizer, messages, timings=timings, cache=cache)
+        return [scoring.ScoredMessage(prediction, confidence, severity, timings)
+                for prediction, confidence, severity in zip(predictions, confidences, severities)]
+    return MicroBatcher(score_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
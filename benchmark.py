@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import scoring
+from clustering import NearDuplicateIndex
+from storage import FlagStore, FlagWriter, TIMESTAMP_FORMAT
+
+# Reproducible benchmarks for the scoring and reporting hot paths:
+#
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json --compare before.json
+#   python benchmark.py --suites single,batch --messages 50000 --length-dist lognormal
+#
+# Messages are synthetic, drawn from the model vocabulary and the abusive
+# lexicon with a seeded RNG, so runs with the same arguments see the same
+# corpus. Results are written as JSON (metadata plus one entry per benchmark);
+# --compare prints the change of every metric against an earlier result file.
+
+# Model files default to the ones next to this script
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SUITES = ["load", "single", "batch", "lexicon", "append", "history"]
+
+FILLER_WORDS = ["the", "a", "you", "u", "is", "are", "lol", "so", "and", "to", "this", "my", "omg", "!!", "why"]
+
+LABELS = ["age", "ethnicity", "gender", "other_cyberbullying", "religion"]
+
+# Synthetic messages with word counts from a fixed, uniform or lognormal
+# distribution around `mean_words`, mixing vocabulary, filler and abusive terms
+def synthetic_messages(count, vocabulary, mean_words=20, length_dist="lognormal", abusive_rate=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    if length_dist == "fixed":
+        lengths = np.full(count, mean_words)
+    elif length_dist == "uniform":
+        lengths = rng.integers(1, 2 * mean_words, count)
+    else:
+        sigma = 0.8
+        lengths = rng.lognormal(np.log(mean_words) - sigma ** 2 / 2, sigma, count).astype(int)
+    lengths = np.clip(lengths, 1, None)
+
+    vocabulary = np.array(sorted(vocabulary), dtype=object)
+    filler = np.array(FILLER_WORDS, dtype=object)
+    abusive = np.array(sorted(scoring.abusive_lexicon.matcher().weights), dtype=object)
+    words = rng.choice(vocabulary, lengths.sum())
+    kind = rng.random(lengths.sum())
+    words = np.where(kind < 0.3, rng.choice(filler, len(words)), words)
+    words = np.where(kind > 1 - abusive_rate, rng.choice(abusive, len(words)), words)
+    return [" ".join(chunk) for chunk in np.split(words, np.cumsum(lengths)[:-1])]
+
+# Synthetic flag history spread over the last `days` days
+def synthetic_history(count, messages, days=365, seed=0):
+    rng = np.random.default_rng(seed)
+    now = datetime.now()
+    offsets = np.sort(rng.integers(0, days * 86400, count))[::-1]
+    labels = rng.choice(LABELS, count)
+    confidences = np.round(rng.uniform(40, 100, count), 2)
+    severities = np.round(rng.uniform(0, 100, count), 1)
+    for i in range(count):
+        timestamp = (now - timedelta(seconds=int(offsets[i]))).strftime(TIMESTAMP_FORMAT)
+        yield messages[i % len(messages)], str(labels[i]), float(confidences[i]), float(severities[i]), timestamp
+
+def latency_stats(samples):
+    samples = np.asarray(samples) * 1000
+    return {
+        "calls": len(samples),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p90_ms": float(np.percentile(samples, 90)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+        "max_ms": float(samples.max()),
+    }
+
+def time_calls(fn, args_list):
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+# Best-of-`repeat` wall time of fn()
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_load(args, results):
+    # Cold load from the compact artifact (when current) vs. unpickling
+    for name, compact in (("load.artifact", True), ("load.pickle", False)):
+        samples = time_calls(lambda: scoring.load_models(args.model, args.vectorizer, compact=compact),
+                             [()] * args.repeat)
+        results[name] = latency_stats(samples)
+
+def bench_single(args, results, model, vectorizer, messages):
+    sample = messages[:args.single_calls]
+    scoring.score_batch(model, vectorizer, sample[:10])
+    results["single.score"] = latency_stats(
+        time_calls(lambda message: scoring.score_batch(model, vectorizer, [message]), [(m,) for m in sample]))
+
+def bench_batch(args, results, model, vectorizer, messages):
+    timings = {}
+    def run():
+        timings.clear()
+        for chunk in scoring.iter_chunks(messages):
+            scoring.score_batch(model, vectorizer, chunk, timings=timings)
+    elapsed = best_time(run, args.repeat)
+    results["batch.score"] = {
+        "messages": len(messages),
+        "seconds": elapsed,
+        "messages_per_s": len(messages) / elapsed,
+        "stage_seconds": {stage: seconds for stage, seconds in timings.items()},
+    }
+
+def bench_lexicon(args, results, messages):
+    matcher = scoring.abusive_lexicon.matcher()
+    for name, fn in (("weight", matcher.weight), ("highlight", matcher.highlight)):
+        elapsed = best_time(lambda: [fn(message) for message in messages], args.repeat)
+        results[f"lexicon.{name}"] = {"messages": len(messages), "seconds": elapsed,
+                                      "messages_per_s": len(messages) / elapsed}
+
+def bench_append(args, results, model, vectorizer, messages, workdir):
+    store = FlagStore(path=os.path.join(workdir, "append.db"), legacy_csv=None, archive_dir=workdir)
+    calls = [(message, "religion", 87.5, 66.0) for message in messages[:args.appends]]
+    samples = time_calls(store.append, calls)
+    results["append.single"] = dict(latency_stats(samples), rows_per_s=len(samples) / sum(samples))
+
+    # Batched, with and without near-duplicate clustering of each batch
+    for name, clusterer in (("append.batched", None),
+                            ("append.batched_clustered", NearDuplicateIndex(vectorizer, model))):
+        writer = FlagWriter(FlagStore(path=os.path.join(workdir, f"{name}.db"), legacy_csv=None, archive_dir=workdir,
+                                      clusterer=clusterer))
+        started = time.perf_counter()
+        samples = time_calls(writer.append, calls)
+        writer.flush()
+        elapsed = time.perf_counter() - started
+        writer.close()
+        results[name] = dict(latency_stats(samples), rows_per_s=len(samples) / elapsed)
+
+def bench_history(args, results, messages, workdir):
+    for size in args.history_sizes:
+        store = FlagStore(path=os.path.join(workdir, f"history_{size}.db"), legacy_csv=None, archive_dir=workdir)
+        started = time.perf_counter()
+        rows = synthetic_history(size, messages, seed=args.seed)
+        while True:
+            batch = [row for _, row in zip(range(50000), rows)]
+            if not batch:
+                break
+            store.append_many(batch)
+        load_seconds = time.perf_counter() - started
+        results[f"history_{size}.load"] = {"rows": size, "seconds": load_seconds, "rows_per_s": size / load_seconds}
+
+        today = datetime.now().date()
+        def dashboard():
+            store.total()
+            store.severity_counts()
+            store.average_severity()
+            store.day_count(today)
+            store.type_counts()
+            store.daily_counts()
+        results[f"history_{size}.dashboard"] = latency_stats(time_calls(dashboard, [()] * args.repeat))
+
+        week_ago = datetime.combine(today - timedelta(days=7), datetime.min.time())
+        reports = {
+            "all": {},
+            "high_severity": {"severity": "high"},
+            "label": {"label": "religion"},
+            "last_7_days": {"since": week_ago},
+        }
+        for name, filters in reports.items():
+            samples = time_calls(lambda: store.query(**filters), [()] * args.repeat)
+            results[f"history_{size}.report.{name}"] = dict(latency_stats(samples), rows=len(store.query(**filters)))
+            # One 50-row page from the middle of the results, plus the summary
+            middle = store.count(**filters) // 2
+            samples = time_calls(lambda: store.query_page(**filters, limit=50, offset=middle), [()] * args.repeat)
+            results[f"history_{size}.report_page.{name}"] = latency_stats(samples)
+            samples = time_calls(lambda: store.summary(**filters), [()] * args.repeat)
+            results[f"history_{size}.report_summary.{name}"] = latency_stats(samples)
+
+        # Ranked full-text search for a lexicon term: match count plus the first page
+        term = sorted(scoring.abusive_lexicon.matcher().weights)[0]
+        def search():
+            store.search_count(term)
+            store.search(term, limit=50)
+        results[f"history_{size}.search"] = dict(latency_stats(time_calls(search, [()] * args.repeat)),
+                                                 matches=store.search_count(term))
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=HERE, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def metadata(args):
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().strftime(TIMESTAMP_FORMAT),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "args": {key: value for key, value in vars(args).items()
+                 if key not in ("output", "compare", "model", "vectorizer")},
+    }
+
+# Numeric leaves of a result file, keyed "benchmark.metric"
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+def compare(baseline, current):
+    before, after = flatten(baseline["results"]), flatten(current["results"])
+    lines = [f"Compared with {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta'].get('timestamp')})"]
+    for key in sorted(before.keys() & after.keys()):
+        change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        lines.append(f"  {key:<48} {before[key]:>14.4f} -> {after[key]:>14.4f}  {change:+7.1f}%")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scoring, lexicon matching, flag appends and reporting")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"comma-separated subset of {','.join(SUITES)}")
+    parser.add_argument("--messages", type=int, default=20000, help="corpus size for batch and lexicon benchmarks")
+    parser.add_argument("--mean-words", type=int, default=20)
+    parser.add_argument("--length-dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--abusive-rate", type=float, default=0.05, help="share of words taken from the lexicon")
+    parser.add_argument("--single-calls", type=int, default=2000)
+    parser.add_argument("--appends", type=int, default=2000)
+    parser.add_argument("--history-sizes", default="10000,1000000",
+                        help="comma-separated row counts for dashboard/report benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default=os.path.join(HERE, scoring.MODEL_PATH))
+    parser.add_argument("--vectorizer", default=os.path.join(HERE, scoring.VECTORIZER_PATH))
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+    args.history_sizes = [int(size) for size in args.history_sizes.split(",") if size]
+    suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    model, vectorizer = scoring.load_models(args.model, args.vectorizer)
+    messages = synthetic_messages(max(args.messages, args.single_calls, args.appends), vectorizer.vocabulary_,
+                                  mean_words=args.mean_words, length_dist=args.length_dist,
+                                  abusive_rate=args.abusive_rate, seed=args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="cyberguard-bench-") as workdir:
+        for suite in suites:
+            print(f"Running {suite}...", file=sys.stderr)
+            if suite == "load":
+                bench_load(args, results)
+            elif suite == "single":
+                bench_single(args, results, model, vectorizer, messages)
+            elif suite == "batch":
+                bench_batch(args, results, model, vectorizer, messages[:args.messages])
+            elif suite == "lexicon":
+                bench_lexicon(args, results, messages[:args.messages])
+            elif suite == "append":
+                bench_append(args, results, model, vectorizer, messages, workdir)
+            elif suite == "history":
+                bench_history(args, results, messages, workdir)
+
+    report = {"meta": metadata(args), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(json.load(f), report), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+import argparse
+import hashlib
+from collections import defaultdict
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Near-duplicate clustering of flagged messages, on the TF-IDF vectors the
+# scoring vectorizer already produces:
+#
+#   * a message and a cluster's representative (its first message) are near
+#     duplicates when the cosine similarity of their TF-IDF vectors is at
+#     least `similarity`. Given the model, they also are when all their terms
+#     but at most `minor_changes` on each side are the same and those that
+#     differ are minor: weighted by the classifier below `minor_share` of the
+#     message's most heavily weighted term. So "hey idiot" and "hello idiot"
+#     cluster (plain cosine 0.27), while "you idiot" and "what an idiot, go
+#     die you worthless idiot" do not;
+#   * candidates come from MinHash LSH over each message's set of vocabulary
+#     features (100 hash functions in 20 bands of 5; a band key shared with a
+#     cluster makes it a candidate), plus, given the model, one key for the
+#     set of its most heavily weighted terms, so lookups stay O(bands) per
+#     message. The classifier's weights only pick candidates and tell minor
+#     terms apart; a match is always decided on the text.
+#
+# Clusters are assigned incrementally, in the transaction that logs the flags
+# (FlagStore(..., clusterer=NearDuplicateIndex(vectorizer, model))). Messages
+# with no vocabulary terms have nothing to compare and stay unclustered.
+# Clusters depend on the vocabulary, the model weights and the settings, so a
+# store rebuilds its clusters when any of them changes.
+#
+#   python clustering.py --top 20      (largest clusters in the flag store)
+
+MINHASH_PRIME = (1 << 31) - 1
+# Multiplier mixing a band's hash values into one 64-bit key
+BAND_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+# Bumped whenever assignment changes, so stores re-cluster their history
+CLUSTERING_REVISION = 3
+
+DEFAULT_SIMILARITY = 0.8
+# Terms whose weighted value is at least this share of the message's largest
+# one are its salient terms
+SALIENT_SHARE = 0.5
+# Terms whose weight is below this share of the message's largest one are minor
+MINOR_SHARE = 0.1
+# Minor terms a near-duplicate may add or swap, on each side
+MINOR_CHANGES = 1
+
+# Rows of a sparse matrix scaled to unit length (empty rows stay empty)
+def unit_rows(X):
+    X = X.astype(np.float64)
+    lengths = np.diff(X.indptr)
+    norms = np.sqrt(np.bincount(np.repeat(np.arange(X.shape[0]), lengths), weights=X.data * X.data,
+                                minlength=X.shape[0]))
+    norms[norms == 0.0] = 1.0
+    X.data /= np.repeat(norms, lengths)
+    return X
+
+# Per-term weight of a linear model: the largest absolute coefficient any class
+# gives the term (None for models without coefficients)
+def model_term_weights(model):
+    coef = getattr(model, "coef_", None)
+    if coef is None:
+        return None
+    return np.abs(np.asarray(coef, dtype=np.float64)).max(axis=0)
+
+# For each entry of rows `b_rows` of B, compared with the same-position rows
+# `a_rows` of A: its pair's position, its position in B.data, and the position
+# in A.data of A's entry in the same column (-1 for none). Entries are looked
+# up by (row, column) key, so the cost is linear in the nonzeros of the B rows
+# compared. A must have sorted indices.
+def pair_entries(A, a_rows, B, b_rows):
+    lengths = np.diff(B.indptr)[b_rows]
+    ends = np.cumsum(lengths)
+    pairs = np.repeat(np.arange(len(b_rows)), lengths)
+    entries = np.repeat(B.indptr[b_rows] - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+    if not A.nnz:
+        return pairs, entries, np.full(len(entries), -1)
+    n_features = A.shape[1]
+    a_keys = np.repeat(np.arange(A.shape[0], dtype=np.int64), np.diff(A.indptr)) * n_features + A.indices
+    keys = np.repeat(np.asarray(a_rows, dtype=np.int64), lengths) * n_features + B.indices[entries]
+    found = np.minimum(np.searchsorted(a_keys, keys), len(a_keys) - 1)
+    return pairs, entries, np.where(a_keys[found] == keys, found, -1)
+
+def vocabulary_fingerprint(vectorizer):
+    digest = hashlib.sha1()
+    for term, column in sorted(vectorizer.vocabulary_.items(), key=lambda item: item[1]):
+        digest.update(f"{column}:{term}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+# Representative vectors are stored as little-endian int32 columns followed by float32 weights
+def pack_vector(indices, data):
+    return np.asarray(indices, dtype="<i4").tobytes() + np.asarray(data, dtype="<f4").tobytes()
+
+def unpack_vector(blob):
+    size = len(blob) // 8
+    return np.frombuffer(blob, dtype="<i4", count=size), np.frombuffer(blob, dtype="<f4", offset=4 * size)
+
+class NearDuplicateIndex:
+    def __init__(self, vectorizer, model=None, similarity=DEFAULT_SIMILARITY, permutations=100, bands=20, seed=0,
+                 salient_share=SALIENT_SHARE, minor_share=MINOR_SHARE, minor_changes=MINOR_CHANGES):
+        if permutations % bands:
+            raise ValueError("permutations must be a multiple of bands")
+        self.vectorizer = vectorizer
+        self.weights = None if model is None else model_term_weights(model)
+        self.similarity = similarity
+        self.bands = bands
+        self.salient_share = salient_share
+        self.minor_share = minor_share
+        self.minor_changes = minor_changes
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MINHASH_PRIME, permutations, dtype=np.int64)
+        self._b = rng.integers(0, MINHASH_PRIME, permutations, dtype=np.int64)
+        # Stored clusters are only comparable under the same vocabulary, weights,
+        # hash functions and thresholds
+        weights = "-" if self.weights is None else hashlib.sha1(self.weights.astype("<f8").tobytes()).hexdigest()[:16]
+        self.version = (f"{CLUSTERING_REVISION}:{vocabulary_fingerprint(vectorizer)}:{weights}:{similarity}:"
+                        f"{permutations}:{bands}:{seed}:{salient_share}:{minor_share}:{minor_changes}")
+
+    # Unit rows of a TF-IDF matrix scaled by the model's term weights (None
+    # without a model)
+    def weighted(self, X):
+        if self.weights is None:
+            return None
+        X = X.astype(np.float64)
+        X.data *= self.weights[X.indices]
+        return unit_rows(X)
+
+    # Which entries of a TF-IDF matrix are minor terms, aligned with X.data
+    def minor_terms(self, X):
+        weights = self.weights[X.indices]
+        lengths = np.diff(X.indptr)
+        nonempty = lengths > 0
+        largest = np.zeros(X.shape[0])
+        if X.nnz:
+            largest[nonempty] = np.maximum.reduceat(weights, X.indptr[:-1][nonempty])
+        return weights < self.minor_share * np.repeat(largest, lengths)
+
+    # Similarities of rows `a_rows` of A and `b_rows` of B (both unit rows):
+    # the cosine, raised to `similarity` for pairs that differ only in at
+    # most `minor_changes` minor terms on each side
+    def pair_similarity(self, A, a_rows, B, b_rows):
+        A = A.sorted_indices()
+        pairs, entries, matches = pair_entries(A, a_rows, B, b_rows)
+        shared = matches >= 0
+        similarity = np.bincount(pairs, weights=np.where(shared, A.data[matches] * B.data[entries], 0.0),
+                                 minlength=len(b_rows))
+        if self.weights is None:
+            return similarity
+        a_minor, b_minor = self.minor_terms(A), self.minor_terms(B)
+        a_minor_counts = np.bincount(np.repeat(np.arange(A.shape[0]), np.diff(A.indptr)), weights=a_minor,
+                                     minlength=A.shape[0])
+        # Terms only one side has, and how many of those are minor
+        shared_counts = np.bincount(pairs, weights=shared, minlength=len(b_rows))
+        a_changes = np.diff(A.indptr)[a_rows] - shared_counts
+        b_changes = np.diff(B.indptr)[b_rows] - shared_counts
+        a_minor_changes = a_minor_counts[a_rows] - np.bincount(pairs, weights=shared & a_minor[matches],
+                                                               minlength=len(b_rows))
+        b_minor_changes = np.bincount(pairs, weights=~shared & b_minor[entries], minlength=len(b_rows))
+        minor_only = ((a_changes == a_minor_changes) & (b_changes == b_minor_changes)
+                      & (np.maximum(a_changes, b_changes) <= self.minor_changes))
+        return np.where(minor_only, np.maximum(similarity, self.similarity), similarity)
+
+    # MinHash signatures of the rows of a TF-IDF matrix, one row each, and a
+    # mask of the rows that have any nonzero feature to hash
+    def signatures(self, X):
+        lengths = np.diff(X.indptr)
+        nonempty = lengths > 0
+        signatures = np.zeros((X.shape[0], len(self._a)), dtype=np.int64)
+        if nonempty.any():
+            values = (X.indices.astype(np.int64)[:, None] * self._a + self._b) % MINHASH_PRIME
+            signatures[nonempty] = np.minimum.reduceat(values, X.indptr[:-1][nonempty], axis=0)
+        return signatures, nonempty
+
+    # One int64 key per band of each signature, as a (rows, bands) array
+    def band_keys(self, signatures):
+        signatures = np.atleast_2d(signatures).astype(np.uint64)
+        keys = np.zeros((signatures.shape[0], self.bands), dtype=np.uint64)
+        for column in np.moveaxis(signatures.reshape(len(signatures), self.bands, -1), 2, 0):
+            keys = (keys ^ column) * BAND_MIX
+        return keys.view(np.int64)
+
+    # One int64 key per row of a weighted matrix for its set of salient terms,
+    # or 0 (no key) when those terms hold less than `similarity` of the row's
+    # squared norm, so rows that no few terms dominate stay out of these buckets
+    def salient_keys(self, Xw):
+        keys = np.zeros(Xw.shape[0], dtype=np.int64)
+        for row in range(Xw.shape[0]):
+            start, end = Xw.indptr[row], Xw.indptr[row + 1]
+            data = Xw.data[start:end]
+            salient = data >= self.salient_share * data.max()
+            if data[salient] @ data[salient] < self.similarity:
+                continue
+            terms = np.sort(Xw.indices[start:end][salient])
+            digest = hashlib.blake2b(terms.astype("<i4").tobytes(), digest_size=8).digest()
+            keys[row] = int.from_bytes(digest, "little", signed=True)
+        return keys
+
+    # Candidate keys per row: the MinHash bands, then the salient-term key (0 for none)
+    def row_keys(self, X, Xw):
+        signatures, _ = self.signatures(X)
+        keys = self.band_keys(signatures)
+        if Xw is None:
+            return keys
+        return np.column_stack([keys, self.salient_keys(Xw)])
+
+    # Clusters sharing a band key with any of the given (rows, bands) keys, as
+    # a (row, cluster_id) frame
+    def _candidates(self, conn, band_keys):
+        found = []
+        all_keys = np.unique(band_keys[band_keys != 0]).tolist()
+        for start in range(0, len(all_keys), 500):
+            chunk = all_keys[start:start + 500]
+            found.extend(conn.execute(
+                f"SELECT key, band, cluster_id FROM cluster_bands WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk))
+        if not found:
+            return pd.DataFrame({"row": [], "cluster_id": []})
+        buckets = pd.DataFrame(np.array(found, dtype=np.int64), columns=["key", "band", "cluster_id"])
+        rows, bands = np.indices(band_keys.shape)
+        wanted = pd.DataFrame({"row": rows.ravel(), "band": bands.ravel(), "key": band_keys.ravel()})
+        return wanted.merge(buckets, on=["band", "key"])[["row", "cluster_id"]].drop_duplicates()
+
+    # Stored representative vectors as a CSR matrix, one row per cluster id
+    def _vectors(self, conn, cluster_ids, n_features):
+        blobs = {}
+        for start in range(0, len(cluster_ids), 500):
+            chunk = cluster_ids[start:start + 500]
+            blobs.update(conn.execute(f"SELECT id, vector FROM clusters WHERE id IN ({', '.join('?' * len(chunk))})",
+                                      chunk))
+        vectors = [unpack_vector(blobs[cluster_id]) for cluster_id in cluster_ids]
+        indptr = np.concatenate([[0], np.cumsum([len(indices) for indices, _ in vectors])])
+        return sp.csr_matrix((np.concatenate([data for _, data in vectors]),
+                              np.concatenate([indices for indices, _ in vectors]), indptr),
+                             shape=(len(vectors), n_features))
+
+    # Assign (flag id, message, label, timestamp) rows to clusters inside the
+    # caller's write transaction, creating clusters for messages without a
+    # near-duplicate. Returns the number of rows clustered.
+    def assign(self, conn, rows):
+        rows = list(rows)
+        if not rows:
+            return 0
+        # Repeated messages are assigned once, through their first occurrence
+        first = {}
+        for row, (_, message, _, _) in enumerate(rows):
+            first.setdefault(str(message), row)
+        unique = list(first.values())
+        X = unit_rows(self.vectorizer.transform([str(rows[row][1]) for row in unique]).tocsr())
+        nonempty = np.diff(X.indptr) > 0
+        unique = np.asarray(unique)[nonempty]
+        X = X[nonempty]
+        Xw = self.weighted(X)
+        band_keys = self.row_keys(X, Xw)
+
+        # Match against existing clusters in one pass: every (row, candidate)
+        # pair's similarity, keeping the most similar cluster per row
+        best = np.zeros(len(unique), dtype=np.int64)
+        pairs = self._candidates(conn, band_keys)
+        if len(pairs):
+            cluster_ids = np.unique(pairs["cluster_id"].to_numpy())
+            vectors = self._vectors(conn, cluster_ids.tolist(), X.shape[1])
+            pair_rows = pairs["row"].to_numpy()
+            pair_clusters = pairs["cluster_id"].to_numpy()
+            vector_rows = np.searchsorted(cluster_ids, pair_clusters)
+            similarity = self.pair_similarity(X, pair_rows, vectors, vector_rows)
+            accepted = similarity >= self.similarity
+            order = np.lexsort((pair_clusters[accepted], -similarity[accepted], pair_rows[accepted]))
+            matched_rows, first_match = np.unique(pair_rows[accepted][order], return_index=True)
+            best[matched_rows] = pair_clusters[accepted][order][first_match]
+
+        # The rest start clusters, or join one started earlier in this batch
+        next_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM clusters").fetchone()[0]
+        new_clusters, new_bands = [], []
+        buckets, vectors = defaultdict(list), {}
+        # (a row's minor-term mask lines up with its entries of X)
+        minor = None if self.weights is None else self.minor_terms(X)
+        dense, dense_minor = np.zeros(X.shape[1]), np.zeros(X.shape[1], dtype=bool)
+        present = np.zeros(X.shape[1], dtype=bool)
+        for row in np.flatnonzero(best == 0).tolist():
+            keys = band_keys[row].tolist()
+            start, end = X.indptr[row], X.indptr[row + 1]
+            indices, data = X.indices[start:end], X.data[start:end]
+            row_minor = None if minor is None else minor[start:end]
+            candidates = set().union(*map(buckets.get, enumerate(keys), repeat(())))
+            if candidates:
+                dense[indices] = data
+                present[indices] = True
+                if row_minor is not None:
+                    dense_minor[indices] = row_minor
+                for cluster_id in sorted(candidates):
+                    cluster_indices, cluster_data, cluster_minor = vectors[cluster_id]
+                    similarity = dense[cluster_indices] @ cluster_data
+                    if similarity < self.similarity and row_minor is not None:
+                        # Terms only one side has must be few and all minor
+                        shared = present[cluster_indices]
+                        row_changes = len(indices) - shared.sum()
+                        cluster_changes = len(cluster_indices) - shared.sum()
+                        if (max(row_changes, cluster_changes) <= self.minor_changes
+                                and row_minor.sum() - dense_minor[cluster_indices].sum() == row_changes
+                                and cluster_minor[~shared].all()):
+                            similarity = self.similarity
+                    if similarity >= self.similarity:
+                        best[row] = cluster_id
+                        break
+                dense[indices] = 0.0
+                present[indices] = False
+                dense_minor[indices] = False
+            if best[row]:
+                continue
+            best[row] = cluster_id = next_id
+            next_id += 1
+            flag_id, message, label, timestamp = rows[unique[row]]
+            vectors[cluster_id] = (indices, data, row_minor)
+            new_clusters.append((cluster_id, flag_id, str(message), label, pack_vector(indices, data), timestamp))
+            for band, key in enumerate(keys):
+                if key:
+                    buckets[band, key].append(cluster_id)
+                    new_bands.append((key, band, cluster_id))
+
+        assigned = dict(zip((str(rows[row][1]) for row in unique), best.tolist()))
+        members, grown = [], defaultdict(lambda: [0, None])
+        for flag_id, message, _, timestamp in rows:
+            cluster_id = assigned.get(str(message))
+            if cluster_id is None:
+                continue
+            delta = grown[cluster_id]
+            delta[0] += 1
+            if timestamp is not None:
+                delta[1] = timestamp if delta[1] is None else max(delta[1], timestamp)
+            members.append((flag_id, cluster_id))
+
+        conn.executemany("INSERT INTO clusters (id, representative_id, message, type, vector, size, first_seen, "
+                         "last_seen) VALUES (?, ?, ?, ?, ?, 0, ?, NULL)", new_clusters)
+        conn.executemany("INSERT OR IGNORE INTO cluster_bands (key, band, cluster_id) VALUES (?, ?, ?)", new_bands)
+        # (SQLite's MAX() is NULL when any argument is, hence the COALESCE)
+        conn.executemany("UPDATE clusters SET size = size + ?, last_seen = COALESCE(MAX(last_seen, ?), last_seen, ?) "
+                         "WHERE id = ?", [(count, last_seen, last_seen, cluster_id)
+                                          for cluster_id, (count, last_seen) in grown.items()])
+        conn.executemany("INSERT OR REPLACE INTO flag_clusters (flag_id, cluster_id) VALUES (?, ?)", members)
+        return len(members)
+
+def main(argv=None):
+    import scoring
+    from storage import ARCHIVE_DIR, DB_PATH, FlagStore
+
+    parser = argparse.ArgumentParser(description="Cluster flagged messages into near-duplicate groups")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--top", type=int, default=10, help="largest clusters to print")
+    args = parser.parse_args(argv)
+
+    model, vectorizer = scoring.load_models()
+    # Opening the store with a clusterer brings its clusters up to date
+    store = FlagStore(args.db, legacy_csv=None, archive_dir=args.archive_dir,
+                      clusterer=NearDuplicateIndex(vectorizer, model))
+    summary = store.cluster_summary()
+    print(f"{summary['clustered']:,} flags in {summary['clusters']:,} clusters; "
+          f"{summary['duplicate_flags']:,} in {summary['duplicate_clusters']:,} clusters with near-duplicates")
+    with pd.option_context("display.max_colwidth", 60, "display.width", 160):
+        print(store.top_clusters(args.top).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
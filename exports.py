@@ -0,0 +1,122 @@
+import importlib.util
+import io
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from storage import COLUMNS
+
+# Report exports, streamed: rows are read from the store a chunk at a time
+# (FlagStore.iter_query) and each chunk is encoded and handed on before the
+# next is read, so memory stays bounded by the chunk size whatever the export.
+#
+#   with open("export.csv.gz", "wb") as f:
+#       write_export(store, f, "csv.gz", severity="high")
+#
+# CSV keeps the Reports table's "87.50%" confidence text; Parquet is typed
+# (float confidence/severity, datetime timestamp) and needs pyarrow.
+
+# Format -> MIME type
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "csv.gz": "application/gzip",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Rows read from the store per chunk
+EXPORT_CHUNK_SIZE = 50000
+
+EXPORT_COLUMNS = list(COLUMNS)
+
+def available_formats():
+    if importlib.util.find_spec("pyarrow"):
+        return list(EXPORT_FORMATS)
+    return [fmt for fmt in EXPORT_FORMATS if fmt != "parquet"]
+
+def export_filename(fmt, stem="flagged_messages_export"):
+    return f"{stem}.{fmt}"
+
+# "87.50%" text for a confidence column ("" where missing), vectorized
+def format_confidence(confidence):
+    values = confidence.to_numpy(dtype=float)
+    text = np.char.mod("%.2f%%", np.nan_to_num(values)).astype(object)
+    return pd.Series(np.where(np.isnan(values), "", text), index=confidence.index)
+
+def _csv_chunks(frames):
+    header = True
+    for df in frames:
+        df = df.copy()
+        df["Confidence"] = format_confidence(df["Confidence"])
+        yield df.to_csv(index=False, header=header).encode("utf-8")
+        header = False
+    if header:
+        yield (",".join(EXPORT_COLUMNS) + "\n").encode("utf-8")
+
+def _gzip_chunks(frames):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for data in _csv_chunks(frames):
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+# Write-only file object that hands over what has been written so far, so the
+# Parquet writer's output can be forwarded one row group at a time
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+def _parquet_chunks(frames):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export requires pyarrow (pip install pyarrow)")
+    schema = pa.schema([("Message", pa.string()), ("Type", pa.string()), ("Confidence", pa.float64()),
+                        ("Severity", pa.float64()), ("Timestamp", pa.timestamp("ns"))])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for df in frames:
+            df = df.astype({"Type": str})
+            writer.write_table(pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False))
+            data = sink.take()
+            if data:
+                yield data
+    yield sink.take()
+
+# Export bytes for the rows matching the filters, yielded chunk by chunk
+def export_chunks(store, fmt="csv", severity=None, label=None, since=None, chunk_size=EXPORT_CHUNK_SIZE):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Export format must be one of {', '.join(EXPORT_FORMATS)}")
+    frames = store.iter_query(severity, label, since, columns=EXPORT_COLUMNS, chunk_size=chunk_size)
+    if fmt == "csv":
+        return _csv_chunks(frames)
+    if fmt == "csv.gz":
+        return _gzip_chunks(frames)
+    return _parquet_chunks(frames)
+
+# Stream an export into a binary file object; returns the bytes written
+def write_export(store, f, fmt="csv", chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    written = 0
+    for data in export_chunks(store, fmt, chunk_size=chunk_size, **filters):
+        f.write(data)
+        written += len(data)
+    return written
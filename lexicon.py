@@ -0,0 +1,129 @@
+import csv
+import os
+import re
+import threading
+import time
+
+# Build one regex from a character trie of the terms, so a scan costs about
+# the length of the text times the trie depth instead of one pass per term.
+# Whitespace inside multi-word terms matches any run of whitespace.
+def trie_pattern(terms):
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        branches = [(r"\s+" if ch.isspace() else re.escape(ch)) + build(child)
+                    for ch, child in sorted(node.items()) if ch != ""]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if "" in node else group
+
+    return build(trie)
+
+def normalize_term(term):
+    return " ".join(term.lower().split())
+
+# Weight of a lexicon term when the file gives none
+DEFAULT_TERM_WEIGHT = 5
+
+# Abusive-word matcher compiled once: whole-word, case-insensitive, single scan.
+# `terms` is an iterable of terms or a {term: weight} mapping.
+# Where terms overlap (e.g. "kill" and "kill yourself") the longest match wins.
+class LexiconMatcher:
+    def __init__(self, terms):
+        if not isinstance(terms, dict):
+            terms = {term: DEFAULT_TERM_WEIGHT for term in terms}
+        self.weights = {normalize_term(term): float(weight) for term, weight in terms.items() if term.strip()}
+        self.terms = sorted(self.weights)
+        self.pattern = re.compile(rf"\b(?:{trie_pattern(self.terms)})\b", re.IGNORECASE) if self.terms else None
+
+    def __len__(self):
+        return len(self.terms)
+
+    def find(self, text):
+        if self.pattern is None:
+            return []
+        return [(m.start(), m.end(), normalize_term(m.group(0))) for m in self.pattern.finditer(text)]
+
+    # Distinct lexicon terms present in the text
+    def matched_terms(self, text):
+        return {term for _, _, term in self.find(text)}
+
+    # Sum of the weights of the distinct terms present in the text
+    def weight(self, text):
+        return sum(self.weights.get(term, DEFAULT_TERM_WEIGHT) for term in self.matched_terms(text))
+
+    def highlight(self, text, template="**:red[{}]**"):
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(lambda m: template.format(m.group(0).upper()), text)
+
+# Lexicon files are CSV with a term and an optional weight per line; blank
+# lines, lines starting with '#' and a "term,weight" header are skipped.
+def read_lexicon(path):
+    terms = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+                continue
+            term = row[0].strip()
+            weight = row[1].strip() if len(row) > 1 else ""
+            if term.lower() == "term" and weight.lower() == "weight":
+                continue
+            terms[term] = float(weight) if weight else DEFAULT_TERM_WEIGHT
+    return terms
+
+# A lexicon file compiled into a LexiconMatcher and rebuilt only when the file
+# changes. The file is stat'ed at most once per `check_interval` seconds; if it
+# is missing or unreadable the default terms (or the last good build) are used.
+class LexiconFile:
+    def __init__(self, path, default_terms=(), check_interval=1.0):
+        self.path = path
+        self.default_terms = default_terms
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        # Bumped on every rebuild so caches of severity scores can be keyed on it
+        self.version = 0
+        self._matcher = LexiconMatcher(default_terms)
+        self.reload_if_changed(force=True)
+
+    def _stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload_if_changed(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            self._checked_at = now
+            signature = self._stat_signature()
+            if signature == self._signature:
+                return False
+            if signature is None:
+                self._matcher = LexiconMatcher(self.default_terms)
+            else:
+                try:
+                    self._matcher = LexiconMatcher(read_lexicon(self.path))
+                except (OSError, ValueError):
+                    # Keep serving the previous lexicon until the file is fixed
+                    return False
+            self._signature = signature
+            self.version += 1
+            return True
+
+    def matcher(self):
+        self.reload_if_changed()
+        return self._matcher
@@ -0,0 +1,122 @@
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-stage latency metrics: timing spans feed one histogram per stage, which
+# the admin panel summarizes and which are exported in Prometheus text format
+# (GET /metrics on the API, or a file for node_exporter's textfile collector).
+# Metrics are per process; ParallelScorer workers do not report theirs.
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_NAME = "cyberguard_stage_duration_seconds"
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # Estimated quantile, interpolating linearly inside the bucket it falls in
+    # (the same estimate as Prometheus' histogram_quantile), capped at the maximum
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[index - 1] if index > 0 else 0.0
+                high = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+class StageMetrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    # with metrics.span("vectorize"): ...
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    # One row per stage with count and latency percentiles in milliseconds
+    def summary(self):
+        with self._lock:
+            rows = []
+            for stage, histogram in sorted(self._histograms.items()):
+                rows.append({
+                    "stage": stage,
+                    "count": histogram.count,
+                    "p50_ms": histogram.quantile(0.5) * 1000,
+                    "p90_ms": histogram.quantile(0.9) * 1000,
+                    "p99_ms": histogram.quantile(0.99) * 1000,
+                    "mean_ms": histogram.sum / histogram.count * 1000,
+                    "max_ms": histogram.max * 1000,
+                })
+            return rows
+
+    def prometheus_text(self):
+        lines = [f"# HELP {METRIC_NAME} Wall time spent in each processing stage.",
+                 f"# TYPE {METRIC_NAME} histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {histogram.sum!r}')
+                lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    # Rewrite `path` every `interval` seconds on a daemon thread
+    def export_periodically(self, path, interval=15):
+        def run():
+            while True:
+                try:
+                    self.write_prometheus(path)
+                except OSError:
+                    pass
+                time.sleep(interval)
+        thread = threading.Thread(target=run, name="metrics-export", daemon=True)
+        thread.start()
+        return thread
+
+# Process-wide registry used by scoring, the app and the API
+metrics = StageMetrics()
@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import scoring
+
+# Multi-core batch scoring. TF-IDF tokenization is single-threaded Python, so
+# large jobs are sharded across worker processes. Each worker loads the models
+# once, memory-mapping the compact artifact (or the pickles' arrays) so the OS
+# page cache is shared between workers, and shards come back in input order.
+#
+# Workers are started with "spawn" because the Streamlit server and the API are
+# multi-threaded, and forking a threaded process is unsafe.
+
+_worker_models = None
+
+def _init_worker(model_path, vectorizer_path):
+    global _worker_models
+    _worker_models = scoring.load_models(model_path, vectorizer_path, mmap=True)
+
+def _score_shard(messages):
+    model, vectorizer = _worker_models
+    predictions, confidences, severities = scoring.score_batch(model, vectorizer, messages)
+    return predictions.astype(str), confidences, severities
+
+class ParallelScorer:
+    def __init__(self, workers=None, model_path=scoring.MODEL_PATH, vectorizer_path=scoring.VECTORIZER_PATH):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_path, vectorizer_path))
+
+    # Score an iterable of shards (lists of messages), yielding (shard, results)
+    # in input order. At most two shards per worker are in flight, so memory
+    # stays bounded when the shards come from a stream.
+    def imap(self, shards):
+        return self.imap_tagged((shard, shard) for shard in shards)
+
+    # Like imap, for (tag, shard) pairs; yields (tag, results)
+    def imap_tagged(self, items):
+        pending = deque()
+        for tag, shard in items:
+            pending.append((tag, self._pool.submit(_score_shard, shard)))
+            if len(pending) >= self.workers * 2:
+                tag, future = pending.popleft()
+                yield tag, future.result()
+        while pending:
+            tag, future = pending.popleft()
+            yield tag, future.result()
+
+    # Same return shape as scoring.score_batch
+    def score(self, messages, shard_size=scoring.BATCH_CHUNK_SIZE):
+        messages = [str(message) for message in messages]
+        predictions, confidences, severities = [], [], []
+        for _, (shard_predictions, shard_confidences, shard_severities) in self.imap(
+                scoring.iter_chunks(messages, shard_size)):
+            predictions.append(shard_predictions)
+            confidences.append(shard_confidences)
+            severities.extend(shard_severities)
+        if not predictions:
+            return np.array([], dtype=object), np.array([], dtype=float), []
+        return np.concatenate(predictions).astype(object), np.concatenate(confidences), severities
+
+    def close(self):
+        self._pool.shutdown()
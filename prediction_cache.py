@@ -0,0 +1,95 @@
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Default memory budget for cached predictions
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Case and whitespace runs do not change the TF-IDF tokens or lexicon matches,
+# so they are normalized away before hashing.
+def normalize_message(text):
+    return " ".join(str(text).lower().split())
+
+def file_fingerprint(*paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+# LRU cache of (prediction, confidence, severity) keyed by a hash of the
+# normalized message, the model version and the lexicon version. Bounded by an
+# approximate memory budget; entries optionally expire after `ttl` seconds.
+class PredictionCache:
+    def __init__(self, model_version, max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+        self.model_version = model_version
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, message, lexicon_version=0):
+        raw = f"{self.model_version}\0{lexicon_version}\0{normalize_message(message)}"
+        return hashlib.sha1(raw.encode("utf-8")).digest()
+
+    def _entry_size(self, key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value) + 64
+
+    # Cached values for each message, or None where there is no live entry
+    def get_many(self, messages, lexicon_version=0):
+        keys = [self.key(message, lexicon_version) for message in messages]
+        now = time.monotonic()
+        results = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and self.ttl is not None and now - entry[1] > self.ttl:
+                    self._evict(key)
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    results.append(entry[0])
+        return results
+
+    def put_many(self, messages, values, lexicon_version=0):
+        now = time.monotonic()
+        with self._lock:
+            for message, value in zip(messages, values):
+                key = self.key(message, lexicon_version)
+                if key in self._entries:
+                    self._evict(key)
+                size = self._entry_size(key, value)
+                self._entries[key] = (value, now, size)
+                self.bytes += size
+            while self.bytes > self.max_bytes and self._entries:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,220 @@
+import functools
+import os
+import time
+from collections import namedtuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import artifact
+from lexicon import LexiconFile
+from metrics import metrics
+from prediction_cache import DEFAULT_MAX_BYTES, PredictionCache, file_fingerprint
+
+MODEL_PATH = "cyberbullying_model.pkl"
+VECTORIZER_PATH = "tfidf_vectorizer.pkl"
+
+# Number of messages vectorized and classified per predict_proba call
+BATCH_CHUNK_SIZE = 5000
+
+# Compact array export of the pickles (see artifact.py), kept next to the model
+ARTIFACT_DIR = "model_artifact"
+
+def artifact_dir_for(model_path):
+    return os.path.join(os.path.dirname(model_path), ARTIFACT_DIR)
+
+# Load model and vectorizer (no Streamlit dependency, shared by UI and services)
+# With mmap=True the fitted arrays are memory-mapped read-only from the pickles,
+# so several processes loading the same files share those pages.
+# With compact=True the compact artifact is used when it was exported from these
+# exact pickles, and is (re)exported after unpickling otherwise, so only the
+# first start pays for importing scikit-learn.
+def load_models(model_path=MODEL_PATH, vectorizer_path=VECTORIZER_PATH, mmap=False, compact=True):
+    with metrics.span("model_load"):
+        return _load_models(model_path, vectorizer_path, mmap, compact)
+
+def _load_models(model_path, vectorizer_path, mmap, compact):
+    if compact:
+        artifact_dir = artifact_dir_for(model_path)
+        source_version = file_fingerprint(model_path, vectorizer_path)
+        if artifact.is_current(artifact_dir, source_version):
+            try:
+                return artifact.load_artifact(artifact_dir)
+            except (OSError, ValueError):
+                pass
+    mmap_mode = "r" if mmap else None
+    model = joblib.load(model_path, mmap_mode=mmap_mode)
+    vectorizer = joblib.load(vectorizer_path, mmap_mode=mmap_mode)
+    if compact:
+        try:
+            artifact.export_verified(model, vectorizer, artifact_dir, source_version)
+        except (OSError, ValueError):
+            pass
+    return model, vectorizer
+
+# Abusive words dictionary (used when the lexicon file is missing)
+abusive_words = ["idiot", "stupid", "hate", "dumb", "loser", "kill", "ugly", "die", "pathetic", "worthless",
+                 "trash", "garbage", "scum", "disgusting", "failure"]
+
+# Weighted abusive lexicon, compiled once and hot-reloaded when the file changes.
+# Shared by severity scoring and highlighting. The default file is the one next
+# to this module, whatever the working directory (cron, batch_score.py).
+LEXICON_PATH = os.environ.get("CYBERGUARD_LEXICON",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "abusive_lexicon.csv"))
+abusive_lexicon = LexiconFile(LEXICON_PATH, default_terms=abusive_words)
+
+# Severity scoring system
+def calculate_severity(prediction, confidence, text):
+    base_scores = {
+        "not_cyberbullying": 0,
+        "age": 60,
+        "ethnicity": 85,
+        "gender": 75,
+        "religion": 80,
+        "other_cyberbullying": 70
+    }
+    base = base_scores.get(prediction.lower(), 50)
+    confidence_factor = confidence / 100
+    abusive_factor = min(abusive_lexicon.matcher().weight(text), 20)
+    severity = min(100, base * confidence_factor + abusive_factor)
+    return round(severity, 1)
+
+def get_severity_level(score):
+    if score < 20:
+        return "SAFE", "#10b981", "🟢"
+    elif score < 40:
+        return "LOW", "#3b82f6", "🔵"
+    elif score < 60:
+        return "MEDIUM", "#f59e0b", "🟡"
+    elif score < 80:
+        return "HIGH", "#f97316", "🟠"
+    else:
+        return "CRITICAL", "#ef4444", "🔴"
+
+# Batch scoring engine: one sparse matrix and one probability pass per chunk.
+# The label is the argmax of the probabilities, which is what model.predict returns.
+# If a `timings` dict is given, per-stage wall time in seconds is added to it.
+# Stage times are also recorded in metrics.metrics, along with the whole call as "score".
+# With a PredictionCache, only messages not already cached reach the model.
+def score_batch(model, vectorizer, messages, timings=None, cache=None):
+    with metrics.span("score"):
+        return _score_batch(model, vectorizer, messages, timings, cache)
+
+def _score_batch(model, vectorizer, messages, timings, cache):
+    messages = [str(message) for message in messages]
+    if not messages:
+        return np.array([], dtype=object), np.array([], dtype=float), []
+    if cache is None:
+        return _score_uncached(model, vectorizer, messages, timings)
+
+    abusive_lexicon.reload_if_changed()
+    lexicon_version = abusive_lexicon.version
+    values = cache.get_many(messages, lexicon_version)
+    hits = sum(value is not None for value in values)
+    missing = list(dict.fromkeys(message for message, value in zip(messages, values) if value is None))
+    if missing:
+        predictions, confidences, severities = _score_uncached(model, vectorizer, missing, timings)
+        scored = [(str(prediction), float(confidence), float(severity))
+                  for prediction, confidence, severity in zip(predictions, confidences, severities)]
+        cache.put_many(missing, scored, lexicon_version)
+        by_message = dict(zip(missing, scored))
+        values = [value if value is not None else by_message[message] for message, value in zip(messages, values)]
+    if timings is not None:
+        timings["cache_hits"] = timings.get("cache_hits", 0) + hits
+    predictions = np.array([value[0] for value in values], dtype=object)
+    confidences = np.array([value[1] for value in values], dtype=float)
+    return predictions, confidences, [value[2] for value in values]
+
+# Linear models are scored from their fitted arrays (artifact.LinearScorer),
+# which gives the same numbers as predict_proba without its per-call overhead
+@functools.lru_cache(maxsize=8)
+def linear_scorer(model):
+    return artifact.LinearScorer(model) if artifact.supports_linear_scoring(model) else None
+
+def _score_uncached(model, vectorizer, messages, timings=None):
+    started = time.perf_counter()
+    vect_input = vectorizer.transform(messages)
+    vectorized = time.perf_counter()
+    scorer = linear_scorer(model)
+    if scorer is not None:
+        predictions, confidences = scorer.predict(vect_input)
+    else:
+        proba = model.predict_proba(vect_input)
+        best = proba.argmax(axis=1)
+        predictions = model.classes_[best]
+        confidences = proba[np.arange(len(messages)), best]
+    confidences = confidences * 100
+    predicted = time.perf_counter()
+    severities = [calculate_severity(prediction, confidence, message)
+                  for prediction, confidence, message in zip(predictions, confidences, messages)]
+    stages = {"vectorize": vectorized - started, "predict": predicted - vectorized,
+              "severity": time.perf_counter() - predicted}
+    for stage, seconds in stages.items():
+        metrics.observe(stage, seconds)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+    return predictions, confidences, severities
+
+# Cache keyed on the model and vectorizer file contents
+def make_prediction_cache(max_bytes=DEFAULT_MAX_BYTES, ttl=None, model_path=MODEL_PATH, vectorizer_path=VECTORIZER_PATH):
+    return PredictionCache(file_fingerprint(model_path, vectorizer_path), max_bytes=max_bytes, ttl=ttl)
+
+# Result of scoring one message; `timings` covers the whole batch it was scored in
+ScoredMessage = namedtuple("ScoredMessage", ["prediction", "confidence", "severity", "timings"])
+
+def iter_chunks(items, chunk_size=BATCH_CHUNK_SIZE):
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+# Build the Batch Analysis results table for one scored chunk
+def batch_results_frame(messages, predictions, confidences, severities):
+    messages = pd.Series(messages, dtype=object).astype(str)
+    predictions = pd.Series(predictions, dtype=object).astype(str)
+    truncated = messages.str.slice(0, 50) + np.where(messages.str.len() > 50, "...", "")
+    return pd.DataFrame({
+        'Message': truncated.values,
+        'Classification': predictions.str.replace("_", " ").str.title().values,
+        'Confidence': [f"{confidence:.1f}%" for confidence in confidences],
+        'Severity': severities,
+        'Status': np.where(predictions.str.lower() == 'not_cyberbullying', 'Safe', 'Flagged')
+    })
+
+# Streaming CSV scoring: read the 'message' column in fixed-size chunks, score
+# each chunk and append its rows to `output`, so memory is bounded by the chunk
+# size rather than the file size. Returns running totals for the summary.
+STREAM_CHUNK_SIZE = 10000
+
+# Message chunks of a CSV, timing each read as the "csv_read" stage
+def _read_csv_chunks(source, chunk_size):
+    reader = iter(pd.read_csv(source, usecols=['message'], chunksize=chunk_size))
+    while True:
+        with metrics.span("csv_read"):
+            chunk = next(reader, None)
+        if chunk is None:
+            return
+        yield chunk
+
+# With a parallel.ParallelScorer as `scorer`, chunks are scored across processes.
+def score_csv_stream(model, vectorizer, source, output, chunk_size=STREAM_CHUNK_SIZE, on_chunk=None, cache=None,
+                     scorer=None):
+    totals = {"rows": 0, "flagged": 0, "safe": 0, "severity_sum": 0.0}
+    header = True
+    chunks = (chunk['message'].astype(str).tolist() for chunk in _read_csv_chunks(source, chunk_size))
+    if scorer is None:
+        scored = ((messages, score_batch(model, vectorizer, messages, cache=cache)) for messages in chunks)
+    else:
+        scored = scorer.imap(chunks)
+    for messages, (predictions, confidences, severities) in scored:
+        results_df = batch_results_frame(messages, predictions, confidences, severities)
+        results_df.to_csv(output, index=False, header=header)
+        header = False
+
+        flagged = int((results_df['Status'] == 'Flagged').sum())
+        totals["rows"] += len(results_df)
+        totals["flagged"] += flagged
+        totals["safe"] += len(results_df) - flagged
+        totals["severity_sum"] += float(results_df['Severity'].sum())
+        if on_chunk is not None:
+            on_chunk(results_df, totals)
+    return totals
@@ -0,0 +1,994 @@
+import argparse
+import atexit
+import collections
+import csv
+import gzip
+import importlib.util
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from batching import QueueBatcher
+from metrics import metrics
+
+DB_PATH = "flagged_messages.db"
+LEGACY_CSV_PATH = "flagged_messages.csv"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Rotated history: rows older than the retention window move out of the live
+# table into one segment file per day. Dashboard aggregates keep counting them;
+# reports read only the segments on or after a date filter's start day.
+#
+# Segment formats: "parquet" is typed and columnar (categorical type, float
+# confidence/severity, datetime64 timestamp), so reports read just the columns
+# they need without re-parsing text; "csv.gz" and "csv" need no pyarrow. The
+# format is a setting, not a guess from what is installed: a store switched to
+# another format converts its older segments with migrate_archive().
+ARCHIVE_DIR = "flagged_history"
+ARCHIVE_COLUMNS = ["id", "message", "type", "confidence", "severity", "timestamp"]
+ARCHIVE_FORMATS = ("parquet", "csv.gz", "csv")
+DEFAULT_ARCHIVE_FORMAT = "parquet"
+PARTITION_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})\.(parquet|csv\.gz|csv)$")
+DEFAULT_RETAIN_DAYS = 30
+
+# Durability policy (SQLite's synchronous pragma): FULL fsyncs the WAL on every
+# commit, NORMAL only at checkpoints (a power loss can drop the last commits but
+# never corrupts the database), OFF leaves flushing to the OS.
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# Column names used by the dashboard and reports, mapped to table columns
+COLUMNS = {
+    "Message": "message",
+    "Type": "type",
+    "Confidence": "confidence",
+    "Severity": "severity",
+    "Timestamp": "timestamp",
+}
+
+# Severity filter buckets shared by the dashboard and reports (lower bound inclusive)
+SEVERITY_BUCKETS = {
+    "low": (None, 40),
+    "medium": (40, 80),
+    "high": (80, None),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS flagged (
+    id INTEGER PRIMARY KEY,
+    message TEXT NOT NULL,
+    type TEXT NOT NULL,
+    confidence REAL,
+    severity REAL,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_flagged_timestamp ON flagged(timestamp);
+CREATE INDEX IF NOT EXISTS idx_flagged_type ON flagged(type);
+CREATE INDEX IF NOT EXISTS idx_flagged_severity ON flagged(severity);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS aggregates (
+    kind TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    severity_sum REAL NOT NULL DEFAULT 0,
+    severity_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, bucket)
+);
+CREATE TABLE IF NOT EXISTS clusters (
+    id INTEGER PRIMARY KEY,
+    representative_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    type TEXT,
+    vector BLOB NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    first_seen TEXT,
+    last_seen TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_clusters_size ON clusters(size);
+CREATE TABLE IF NOT EXISTS cluster_bands (
+    key INTEGER NOT NULL,
+    band INTEGER NOT NULL,
+    cluster_id INTEGER NOT NULL,
+    PRIMARY KEY (key, band, cluster_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS flag_clusters (
+    flag_id INTEGER PRIMARY KEY,
+    cluster_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_flag_clusters_cluster ON flag_clusters(cluster_id);
+"""
+
+# Full-text search: one contentless FTS5 index over every flagged message, live
+# and archived, keyed by row id and filled in the transaction that inserts the
+# rows. Rows keep their index entries when rotation moves them out of the live
+# table; `archived` records which day's segment holds them and their filter
+# columns, so searches filter in SQL and read only the segments of one page.
+SEARCH_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS flagged_fts USING fts5("
+    "message, content='', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TABLE IF NOT EXISTS archived (id INTEGER PRIMARY KEY, day TEXT NOT NULL, type TEXT, severity REAL, "
+    "timestamp TEXT)",
+]
+
+# Search hits with the columns filters apply to: live values, or the archived
+# copies for rows rotated out of the live table
+SEARCH_ROWS = """SELECT flagged_fts.rowid AS id, flagged_fts.rank AS rank, a.day AS day, l.id IS NOT NULL AS live,
+    COALESCE(l.type, a.type) AS type, COALESCE(l.severity, a.severity) AS severity,
+    COALESCE(l.timestamp, a.timestamp) AS timestamp
+FROM flagged_fts LEFT JOIN flagged AS l ON l.id = flagged_fts.rowid LEFT JOIN archived AS a ON a.id = flagged_fts.rowid
+WHERE flagged_fts MATCH ? AND (l.id IS NOT NULL OR a.id IS NOT NULL)"""
+
+# FTS5 query matching messages that contain every word of `text` (as a term or
+# phrase of terms), so user input never reaches the query syntax
+def search_expression(text):
+    words = [word.replace('"', '""') for word in str(text).split()]
+    return " ".join(f'"{word}"' for word in words)
+
+def severity_bucket(severity):
+    if severity is None:
+        return None
+    for name, (low, high) in SEVERITY_BUCKETS.items():
+        if (low is None or severity >= low) and (high is None or severity < high):
+            return name
+    return None
+
+# Running dashboard aggregates for a set of rows: counts per type, severity
+# bucket and day, plus the overall count and severity sum. Keyed by (kind, bucket).
+def aggregate_deltas(rows):
+    deltas = {}
+    for _, label, _, severity, timestamp in rows:
+        keys = [("total", ""), ("type", label)]
+        bucket = severity_bucket(severity)
+        if bucket is not None:
+            keys.append(("severity", bucket))
+        if timestamp:
+            keys.append(("day", timestamp[:10]))
+        for key in keys:
+            delta = deltas.setdefault(key, [0, 0.0, 0])
+            delta[0] += 1
+            if severity is not None:
+                delta[1] += severity
+                delta[2] += 1
+    return deltas
+
+# History rows with float confidence/severity and datetime64 timestamps, the
+# way reports use them (also applied to CSV segments and live-table reads)
+def typed_history(df):
+    df = df.copy()
+    for column in ("confidence", "severity"):
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype(float)
+    if "timestamp" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["timestamp"]):
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format=TIMESTAMP_FORMAT, errors="coerce")
+    if "type" in df.columns and not isinstance(df["type"].dtype, pd.CategoricalDtype):
+        df["type"] = df["type"].astype("category")
+    return df
+
+def parse_confidence(value):
+    try:
+        return float(str(value).strip().rstrip("%"))
+    except ValueError:
+        return None
+
+def parse_severity(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+# The legacy log mixes 3-column (message, type, confidence), 4-column (+ timestamp)
+# and 5-column (+ severity, timestamp) rows.
+def read_legacy_csv(path):
+    rows = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            message, label, confidence = row[:3]
+            severity, timestamp = None, None
+            if len(row) == 4:
+                timestamp = row[3]
+            elif len(row) >= 5:
+                severity, timestamp = parse_severity(row[3]), row[4]
+            rows.append((message, label, parse_confidence(confidence), severity, timestamp or None))
+    return rows
+
+# SQLite-backed flag store (WAL mode, indexed on timestamp, type and severity).
+# Connections are per thread because Streamlit serves each session on its own thread.
+class FlagStore:
+    # `clusterer` (a clustering.NearDuplicateIndex) assigns near-duplicate
+    # clusters to flags as they are logged
+    def __init__(self, path=DB_PATH, legacy_csv=LEGACY_CSV_PATH, synchronous="NORMAL", archive_dir=ARCHIVE_DIR,
+                 archive_format=DEFAULT_ARCHIVE_FORMAT, clusterer=None):
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous must be one of {', '.join(SYNCHRONOUS_MODES)}")
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"archive_format must be one of {', '.join(ARCHIVE_FORMATS)}")
+        if archive_format == "parquet" and not importlib.util.find_spec("pyarrow"):
+            raise ValueError("Parquet history segments require pyarrow (pip install pyarrow), "
+                             "or choose archive_format 'csv.gz'")
+        self.path = path
+        self.legacy_csv = legacy_csv
+        self.synchronous = synchronous.upper()
+        self.archive_dir = archive_dir
+        self.archive_format = archive_format
+        self.clusterer = clusterer
+        self._rotated_on = None
+        self._stats_cache = {}
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._build_archive_high_water()
+        self.searchable = self._build_search_index()
+        self._import_legacy_csv()
+        self._build_aggregates()
+        if clusterer is not None:
+            self._build_clusters()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy_csv(self):
+        if not self.legacy_csv or not os.path.exists(self.legacy_csv):
+            return
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute("SELECT value FROM meta WHERE key = 'legacy_csv_imported'").fetchone()
+            if done is None:
+                self._insert_rows(conn, read_legacy_csv(self.legacy_csv))
+                conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_csv_imported', ?)",
+                             (datetime.now().strftime(TIMESTAMP_FORMAT),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # Aggregates are maintained incrementally on insert; this only backfills
+    # databases created before the aggregates table existed.
+    def _build_aggregates(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute("SELECT value FROM meta WHERE key = 'aggregates_built'").fetchone()
+            if done is None:
+                conn.execute("DELETE FROM aggregates")
+                cursor = conn.execute("SELECT message, type, confidence, severity, timestamp FROM flagged")
+                while True:
+                    rows = cursor.fetchmany(10000)
+                    if not rows:
+                        break
+                    self._update_aggregates(conn, rows)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('aggregates_built', ?)",
+                             (datetime.now().strftime(TIMESTAMP_FORMAT),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # rotate() records the highest archived id, which new ids are assigned
+    # above; this only backfills it for segments rotated before it was recorded
+    def _build_archive_high_water(self):
+        conn = self._connect()
+        with self._write_transaction(conn):
+            if self._meta(conn, "archived_max_id_built") is None:
+                for path in self.partitions():
+                    ids = self._read_partition(path, ["id"])["id"]
+                    self._record_archived_max_id(conn, ids.max() if len(ids) else None)
+                self._set_meta(conn, "archived_max_id_built", datetime.now().strftime(TIMESTAMP_FORMAT))
+
+    # Creates the search index, backfilling it (and the archived-row table)
+    # from existing rows and segments. Returns False when SQLite is built
+    # without FTS5.
+    def _build_search_index(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute("SELECT value FROM meta WHERE key = 'search_index_built'").fetchone()
+            if done is None:
+                for statement in SEARCH_SCHEMA:
+                    conn.execute(statement)
+                conn.execute("INSERT INTO flagged_fts (rowid, message) SELECT id, message FROM flagged")
+                live_ids = None
+                for path in self.partitions():
+                    if live_ids is None:
+                        live_ids = pd.read_sql_query("SELECT id FROM flagged", conn)["id"]
+                    day = PARTITION_PATTERN.match(os.path.basename(path)).group(1)
+                    rows = self._read_partition(path, ARCHIVE_COLUMNS).drop_duplicates("id")
+                    self._index_archived(conn, day, rows)
+                    # Rows a crashed rotation left live as well are indexed already
+                    rows = rows[~rows["id"].isin(live_ids)]
+                    conn.executemany("INSERT INTO flagged_fts (rowid, message) VALUES (?, ?)",
+                                     zip(rows["id"].tolist(), rows["message"].astype(str)))
+                conn.execute("INSERT INTO meta (key, value) VALUES ('search_index_built', ?)",
+                             (datetime.now().strftime(TIMESTAMP_FORMAT),))
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            conn.execute("ROLLBACK")
+            if "fts5" in str(e):
+                return False
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    # Record archived rows' segment day and filter columns
+    def _index_archived(self, conn, day, rows):
+        rows = rows[["id", "type", "severity", "timestamp"]].copy()
+        if pd.api.types.is_datetime64_any_dtype(rows["timestamp"]):
+            rows["timestamp"] = rows["timestamp"].dt.strftime(TIMESTAMP_FORMAT)
+        rows["type"] = rows["type"].astype(str)
+        rows = rows.astype(object).where(rows.notna(), None)
+        conn.executemany(
+            "INSERT OR REPLACE INTO archived (id, day, type, severity, timestamp) VALUES (?, ?, ?, ?, ?)",
+            ((row_id, day, label, severity, timestamp) for row_id, label, severity, timestamp
+             in rows.itertuples(index=False)))
+
+    def _meta(self, conn, key, default=None):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                     (key, value))
+
+    # Cluster live rows logged since the last clustered id (rows logged by a
+    # store without a clusterer are picked up here too)
+    def _cluster_new_rows(self, conn, limit=None):
+        last_id = int(self._meta(conn, "clustered_max_id", 0))
+        rows = conn.execute("SELECT id, message, type, timestamp FROM flagged WHERE id > ? ORDER BY id"
+                            + ("" if limit is None else f" LIMIT {int(limit)}"), (last_id,)).fetchall()
+        if rows:
+            self.clusterer.assign(conn, rows)
+            self._set_meta(conn, "clustered_max_id", rows[-1][0])
+        return len(rows)
+
+    # Brings the clusters up to date when the store is opened: from scratch
+    # (archived segments, then the live table) when the clusterer's version
+    # changed, otherwise just the rows logged since. Each segment and each
+    # chunk of live rows commits separately, so writers are not held up.
+    # Archived rows were normally clustered while live: each segment day after
+    # clustered_archive_through is read once, and only its rows without a
+    # cluster are assigned.
+    def _build_clusters(self, chunk_size=5000):
+        conn = self._connect()
+        with self._write_transaction(conn):
+            if self._meta(conn, "cluster_version") != self.clusterer.version:
+                for table in ("clusters", "cluster_bands", "flag_clusters"):
+                    conn.execute(f"DELETE FROM {table}")
+                self._set_meta(conn, "cluster_version", self.clusterer.version)
+                self._set_meta(conn, "clustered_max_id", 0)
+                self._set_meta(conn, "clustered_archive_through", "")
+        days = {}
+        for path in self.partitions():
+            days.setdefault(PARTITION_PATTERN.match(os.path.basename(path)).group(1), []).append(path)
+        for day, paths in sorted(days.items()):
+            with self._write_transaction(conn):
+                if day <= self._meta(conn, "clustered_archive_through", ""):
+                    continue
+                rows = pd.concat([self._read_partition(path, ["id", "message", "type", "timestamp"]) for path in paths],
+                                 ignore_index=True).drop_duplicates("id").sort_values("id")
+                if len(rows):
+                    clustered = pd.read_sql_query(
+                        "SELECT flag_id FROM flag_clusters WHERE flag_id BETWEEN ? AND ?", conn,
+                        params=(int(rows["id"].min()), int(rows["id"].max())))["flag_id"]
+                    rows = rows[~rows["id"].isin(clustered)]
+                rows["timestamp"] = rows["timestamp"].dt.strftime(TIMESTAMP_FORMAT)
+                rows = rows.astype(object).where(rows.notna(), None)
+                self.clusterer.assign(conn, rows.itertuples(index=False, name=None))
+                self._set_meta(conn, "clustered_archive_through", day)
+        while True:
+            with self._write_transaction(conn):
+                if not self._cluster_new_rows(conn, limit=chunk_size):
+                    break
+
+    @contextmanager
+    def _write_transaction(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _update_aggregates(self, conn, rows):
+        conn.executemany(
+            "INSERT INTO aggregates (kind, bucket, count, severity_sum, severity_count) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (kind, bucket) DO UPDATE SET count = count + excluded.count, "
+            "severity_sum = severity_sum + excluded.severity_sum, "
+            "severity_count = severity_count + excluded.severity_count",
+            [(kind, bucket, *delta) for (kind, bucket), delta in aggregate_deltas(rows).items()])
+
+    # Ids are assigned above both the live table's and the archive's highest
+    # id: SQLite would otherwise reuse the ids of rows rotated out of the live
+    # table, and archived rows are told apart (and searched) by id. Callers
+    # hold the write lock (BEGIN IMMEDIATE), so the highest id read here is
+    # still the highest when the rows are inserted.
+    def _insert_rows(self, conn, rows):
+        last_id = conn.execute(
+            "SELECT MAX((SELECT COALESCE(MAX(id), 0) FROM flagged), "
+            "COALESCE((SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'archived_max_id'), 0))").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO flagged (id, message, type, confidence, severity, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            [(last_id + offset, *row) for offset, row in enumerate(rows, 1)])
+        # Indexing the new rows with one INSERT ... SELECT is several times
+        # faster than a per-row trigger
+        if self.searchable:
+            conn.execute("INSERT INTO flagged_fts (rowid, message) SELECT id, message FROM flagged WHERE id > ?",
+                         (last_id,))
+        if self.clusterer is not None:
+            self._cluster_new_rows(conn)
+        self._update_aggregates(conn, rows)
+        self._bump_data_version(conn)
+
+    def _bump_data_version(self, conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('data_version', 1) "
+                     "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    # Counter that changes whenever flagged rows are added or cleared (in any
+    # process), for caching anything derived from the store
+    def data_version(self):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def append(self, message, label, confidence, severity, timestamp=None):
+        timestamp = timestamp or datetime.now().strftime(TIMESTAMP_FORMAT)
+        conn = self._connect()
+        with self._write_transaction(conn):
+            self._insert_rows(conn, [(message, str(label), float(confidence), float(severity), timestamp)])
+
+    # Insert (message, label, confidence, severity, timestamp) rows in one transaction
+    def append_many(self, rows):
+        rows = list(rows)
+        conn = self._connect()
+        with self._write_transaction(conn):
+            self._insert_rows(conn, rows)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM flagged")
+            conn.execute("DELETE FROM aggregates")
+            if self.searchable:
+                conn.execute("INSERT INTO flagged_fts (flagged_fts) VALUES ('delete-all')")
+                conn.execute("DELETE FROM archived")
+            for table in ("clusters", "cluster_bands", "flag_clusters"):
+                conn.execute(f"DELETE FROM {table}")
+            # Ids can start again from 1, so clustering restarts from the beginning too
+            conn.execute("UPDATE meta SET value = 0 WHERE key = 'clustered_max_id'")
+            conn.execute("UPDATE meta SET value = '' WHERE key = 'clustered_archive_through'")
+            self._bump_data_version(conn)
+            for path in self.partitions():
+                os.remove(path)
+
+    # Archived segment paths, oldest first; with `since`, only days on or after it.
+    # A day can have segments in several formats after archive_format changes.
+    def partitions(self, since=None):
+        if not self.archive_dir or not os.path.isdir(self.archive_dir):
+            return []
+        first_day = since.strftime("%Y-%m-%d") if since is not None else ""
+        paths = []
+        for name in sorted(os.listdir(self.archive_dir)):
+            match = PARTITION_PATTERN.match(name)
+            if match and match.group(1) >= first_day:
+                paths.append(os.path.join(self.archive_dir, name))
+        return paths
+
+    def _write_partition(self, day, rows, archive_format=None):
+        archive_format = archive_format or self.archive_format
+        path = os.path.join(self.archive_dir, f"{day}.{archive_format}")
+        if archive_format == "parquet":
+            self._write_parquet(path, rows)
+            return
+        data = rows.to_csv(index=False, header=not os.path.exists(path)).encode("utf-8")
+        if path.endswith(".gz"):
+            # Each append is a separate gzip member; readers decompress them as one stream
+            data = gzip.compress(data)
+        with open(path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # Parquet files cannot be appended to, so a day's segment is rewritten with the new rows
+    def _write_parquet(self, path, rows):
+        rows = typed_history(rows)
+        if os.path.exists(path):
+            rows = pd.concat([pd.read_parquet(path), rows], ignore_index=True).drop_duplicates("id", keep="last")
+            rows["type"] = rows["type"].astype("category")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        rows.to_parquet(tmp_path, index=False)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    # Move rows dated before the last `retain_days` days into per-day segments.
+    # Runs under the database write lock. Segments include the row id and
+    # readers keep one row per id, so a crash between writing a segment and
+    # deleting its rows cannot duplicate them.
+    def rotate(self, retain_days=DEFAULT_RETAIN_DAYS, today=None):
+        cutoff = ((today or datetime.now().date()) - timedelta(days=retain_days)).strftime("%Y-%m-%d")
+        condition = "timestamp < ? AND timestamp GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            moved = 0
+            self._record_archived_max_id(conn, conn.execute(
+                f"SELECT MAX(id) FROM flagged WHERE {condition}", (cutoff,)).fetchone()[0])
+            for rows in pd.read_sql_query(f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM flagged WHERE {condition} "
+                                          "ORDER BY id", conn, params=(cutoff,), chunksize=50000):
+                os.makedirs(self.archive_dir, exist_ok=True)
+                for day, day_rows in rows.groupby(rows["timestamp"].str.slice(0, 10), sort=True):
+                    self._write_partition(day, day_rows)
+                    if self.searchable:
+                        self._index_archived(conn, day, day_rows)
+                self._uncover_unclustered_archive(conn, rows)
+                moved += len(rows)
+            if moved:
+                conn.execute(f"DELETE FROM flagged WHERE {condition}", (cutoff,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return moved
+
+    # Rows rotated out before they were clustered (by a store without a
+    # clusterer) move clustered_archive_through back before their day, so the
+    # next store opened with a clusterer reads that segment again
+    def _uncover_unclustered_archive(self, conn, rows):
+        clustered_max_id = self._meta(conn, "clustered_max_id")
+        if clustered_max_id is None:
+            return
+        days = rows.loc[rows["id"] > int(clustered_max_id), "timestamp"].str.slice(0, 10)
+        if len(days):
+            before = (datetime.strptime(days.min(), "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+            if before < self._meta(conn, "clustered_archive_through", ""):
+                self._set_meta(conn, "clustered_archive_through", before)
+
+    def _record_archived_max_id(self, conn, max_id):
+        if max_id is not None:
+            conn.execute("INSERT INTO meta (key, value) VALUES ('archived_max_id', ?) ON CONFLICT (key) "
+                         "DO UPDATE SET value = MAX(CAST(value AS INTEGER), excluded.value)", (int(max_id),))
+
+    # rotate() at most once per calendar day per store object
+    def rotate_daily(self, retain_days=DEFAULT_RETAIN_DAYS):
+        today = datetime.now().date()
+        if self._rotated_on == today:
+            return 0
+        self._rotated_on = today
+        return self.rotate(retain_days, today)
+
+    def _filter_frame(self, df, severity=None, label=None, since=None):
+        mask = pd.Series(True, index=df.index)
+        if severity is not None:
+            low, high = SEVERITY_BUCKETS[severity]
+            if low is not None:
+                mask &= df["severity"] >= low
+            if high is not None:
+                mask &= df["severity"] < high
+        if label is not None:
+            mask &= df["type"] == label
+        if since is not None:
+            mask &= df["timestamp"] >= pd.Timestamp(since.strftime(TIMESTAMP_FORMAT))
+        return df[mask]
+
+    # One segment as a typed frame with the given table columns; with `ids`,
+    # only those rows (filtered in Arrow, before the conversion to pandas)
+    def _read_partition(self, path, usecols, ids=None):
+        if path.endswith(".parquet"):
+            if ids is None:
+                return pd.read_parquet(path, columns=usecols)
+            import pyarrow as pa
+            import pyarrow.compute as pc
+            import pyarrow.parquet as pq
+            table = pq.ParquetFile(path).read(columns=usecols)
+            return table.filter(pc.is_in(table["id"], pa.array(ids, type=table.schema.field("id").type))).to_pandas()
+        df = pd.read_csv(path, usecols=usecols, keep_default_na=False, na_values={"confidence": [""], "severity": [""]},
+                         dtype={"message": str, "type": str, "timestamp": str})
+        if ids is not None:
+            df = df[df["id"].isin(ids)]
+        return typed_history(df)
+
+    # Archived rows matching the filters, reading only the segments the date
+    # filter can match and only the requested table columns (plus filter columns)
+    def _read_archive(self, table_columns, severity=None, label=None, since=None):
+        paths = self.partitions(since)
+        if not paths:
+            return None
+        usecols = self._archive_usecols(table_columns, severity, label, since)
+        frames = []
+        for path in paths:
+            df = self._filter_frame(self._read_partition(path, usecols), severity, label, since)
+            if len(df):
+                frames.append(df)
+        if not frames:
+            return None
+        return pd.concat(frames, ignore_index=True)[["id"] + list(table_columns)]
+
+    def _archive_usecols(self, table_columns, severity=None, label=None, since=None):
+        filter_columns = ([] if severity is None else ["severity"]) + ([] if label is None else ["type"]) \
+            + ([] if since is None else ["timestamp"])
+        return [column for column in ARCHIVE_COLUMNS if column in set(table_columns) | set(filter_columns) | {"id"}]
+
+    def _where(self, severity=None, label=None, since=None):
+        clauses, params = [], []
+        if severity is not None:
+            low, high = SEVERITY_BUCKETS[severity]
+            if low is not None:
+                clauses.append("severity >= ?")
+                params.append(low)
+            if high is not None:
+                clauses.append("severity < ?")
+                params.append(high)
+        if label is not None:
+            clauses.append("type = ?")
+            params.append(label)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since.strftime(TIMESTAMP_FORMAT))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    # Per-type counts and severity totals of the rows matching the filters, with
+    # one column per severity bucket: a GROUP BY over the indexed live table
+    # plus cached per-segment stats for the archive, so nothing is materialized
+    def _stats(self, severity=None, label=None, since=None):
+        buckets = []
+        for name, (low, high) in SEVERITY_BUCKETS.items():
+            bounds = ([] if low is None else [f"severity >= {low}"]) + ([] if high is None else [f"severity < {high}"])
+            buckets.append(f"COALESCE(SUM({' AND '.join(bounds)}), 0) AS {name}")
+        where, params = self._where(severity, label, since)
+        live = pd.read_sql_query(
+            "SELECT type, COUNT(*) AS count, COALESCE(SUM(severity), 0) AS severity_sum, "
+            f"COUNT(severity) AS severity_count, {', '.join(buckets)} FROM flagged{where} GROUP BY type",
+            self._connect(), params=params).set_index("type")
+        frames = [live] + [self._partition_stats(path, severity, label, since) for path in self.partitions(since)]
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return live
+        return pd.concat(frames).groupby(level=0).sum()
+
+    # Stats of one segment, cached on its size and mtime (segments only change
+    # when rotation appends to them). Days starting at or after `since` match
+    # whole, so the key ignores `since` for them and moving date filters stay
+    # cached; only a day `since` falls inside is keyed on it.
+    def _partition_stats(self, path, severity=None, label=None, since=None):
+        day = PARTITION_PATTERN.match(os.path.basename(path)).group(1)
+        if since is not None and datetime.strptime(day, "%Y-%m-%d") >= since:
+            since = None
+        info = os.stat(path)
+        key = (path, info.st_mtime_ns, info.st_size, severity, label,
+               None if since is None else since.strftime(TIMESTAMP_FORMAT))
+        stats = self._stats_cache.get(key)
+        if stats is None:
+            usecols = ["type", "severity"] + ([] if since is None else ["timestamp"])
+            df = self._filter_frame(self._read_partition(path, usecols), severity, label, since)
+            groups = df.groupby(df["type"].astype(str))["severity"]
+            stats = pd.DataFrame({"count": groups.size(), "severity_sum": groups.sum(),
+                                  "severity_count": groups.count()})
+            for name, (low, high) in SEVERITY_BUCKETS.items():
+                in_bucket = pd.Series(True, index=df.index)
+                if low is not None:
+                    in_bucket &= df["severity"] >= low
+                if high is not None:
+                    in_bucket &= df["severity"] < high
+                stats[name] = in_bucket.groupby(df["type"].astype(str)).sum()
+            stats.index.name = "type"
+            if len(self._stats_cache) >= 1024:
+                self._stats_cache.clear()
+            self._stats_cache[key] = stats
+        return stats
+
+    def count(self, severity=None, label=None, since=None):
+        if severity is None and label is None and since is None:
+            return self.total()
+        return int(self._stats(severity, label, since)["count"].sum())
+
+    # Report summary of the rows matching the filters, in the shape of the
+    # dashboard reads: count, average severity, counts per type and per bucket
+    def summary(self, severity=None, label=None, since=None):
+        stats = self._stats(severity, label, since)
+        severity_count = stats["severity_count"].sum()
+        return {
+            "count": int(stats["count"].sum()),
+            "average_severity": stats["severity_sum"].sum() / severity_count if severity_count else None,
+            "type_counts": stats["count"].astype("int64").sort_values(ascending=False, kind="stable"),
+            "severity_counts": {name: int(stats[name].sum()) for name in SEVERITY_BUCKETS},
+        }
+
+    # Dashboard reads: O(#buckets) lookups in the aggregates table
+    def _aggregates(self, kind):
+        return self._connect().execute(
+            "SELECT bucket, count, severity_sum, severity_count FROM aggregates WHERE kind = ? AND count > 0 "
+            "ORDER BY bucket", (kind,)).fetchall()
+
+    def total(self):
+        rows = self._aggregates("total")
+        return rows[0][1] if rows else 0
+
+    def average_severity(self):
+        rows = self._aggregates("total")
+        if not rows or rows[0][3] == 0:
+            return None
+        return rows[0][2] / rows[0][3]
+
+    def types(self):
+        return [bucket for bucket, *_ in self._aggregates("type")]
+
+    def type_counts(self):
+        counts = pd.Series({bucket: n for bucket, n, *_ in self._aggregates("type")}, dtype="int64")
+        return counts.sort_values(ascending=False, kind="stable")
+
+    def severity_counts(self):
+        counts = {bucket: n for bucket, n, *_ in self._aggregates("severity")}
+        return {name: counts.get(name, 0) for name in SEVERITY_BUCKETS}
+
+    def day_count(self, day):
+        row = self._connect().execute(
+            "SELECT count FROM aggregates WHERE kind = 'day' AND bucket = ?", (day.strftime("%Y-%m-%d"),)).fetchone()
+        return row[0] if row else 0
+
+    def daily_counts(self):
+        return pd.DataFrame([(bucket, n) for bucket, n, *_ in self._aggregates("day")], columns=["Date", "Count"])
+
+    # Near-duplicate clusters: how many there are, how many flags they hold,
+    # and how many of each belong to clusters with more than one message
+    def cluster_summary(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size > 1), 0), "
+            "COALESCE(SUM(CASE WHEN size > 1 THEN size ELSE 0 END), 0) FROM clusters").fetchone()
+        return dict(zip(["clusters", "clustered", "duplicate_clusters", "duplicate_flags"], row))
+
+    # Largest clusters with more than one message, one representative each
+    def top_clusters(self, limit=10):
+        return pd.read_sql_query(
+            "SELECT message AS Representative, type AS Type, size AS Messages, first_seen AS \"First Seen\", "
+            "last_seen AS \"Last Seen\" FROM clusters WHERE size > 1 ORDER BY size DESC, id LIMIT ?",
+            self._connect(), params=(limit,))
+
+    # Filtered rows (live and archived, in insertion order) as a DataFrame with
+    # categorical Type, float Severity/Confidence and datetime Timestamp.
+    # Only the requested columns are read.
+    def query(self, severity=None, label=None, since=None, columns=None):
+        columns = columns or list(COLUMNS)
+        table_columns = [COLUMNS[column] for column in columns]
+        where, params = self._where(severity, label, since)
+        df = pd.read_sql_query(f"SELECT id, {', '.join(table_columns)} FROM flagged{where} ORDER BY id",
+                               self._connect(), params=params)
+        df = typed_history(df)
+        archived = self._read_archive(table_columns, severity, label, since)
+        if archived is not None and len(archived):
+            archived = archived.drop_duplicates("id")
+            archived = archived[~archived["id"].isin(df["id"])]
+            frames = [frame for frame in (archived, df) if len(frame)]
+            if frames:
+                df = pd.concat(frames, ignore_index=True).sort_values("id", kind="stable", ignore_index=True)
+        return self._report_frame(df, columns)
+
+    def _report_frame(self, df, columns):
+        if "type" in df.columns:
+            df["type"] = df["type"].astype("category").cat.remove_unused_categories()
+        df = df.drop(columns="id")
+        df.columns = columns
+        return df
+
+    # One page of the rows query() returns, most recently flagged first: the
+    # live table's rows by descending id, then the segments from the newest day
+    # back. Only segments the page overlaps are read; the rest are skipped using
+    # their cached counts. Pair with count() for the number of pages. Rows a
+    # crashed rotation left in both places show twice until the next rotation.
+    def query_page(self, severity=None, label=None, since=None, columns=None, limit=50, offset=0):
+        columns = columns or list(COLUMNS)
+        table_columns = [COLUMNS[column] for column in columns]
+        where, params = self._where(severity, label, since)
+        conn = self._connect()
+        df = typed_history(pd.read_sql_query(
+            f"SELECT id, {', '.join(table_columns)} FROM flagged{where} ORDER BY id DESC LIMIT ? OFFSET ?",
+            conn, params=params + [limit, offset]))
+        frames = [df] if len(df) else []
+        remaining = limit - len(df)
+        if remaining > 0:
+            skip = max(offset - conn.execute(f"SELECT COUNT(*) FROM flagged{where}", params).fetchone()[0], 0)
+            usecols = self._archive_usecols(table_columns, severity, label, since)
+            for path in reversed(self.partitions(since)):
+                matching = int(self._partition_stats(path, severity, label, since)["count"].sum())
+                if skip >= matching:
+                    skip -= matching
+                    continue
+                rows = self._filter_frame(self._read_partition(path, usecols), severity, label, since)
+                rows = rows.sort_values("id", ascending=False, kind="stable").iloc[skip:skip + remaining]
+                frames.append(rows[["id"] + table_columns])
+                remaining -= len(rows)
+                skip = 0
+                if remaining <= 0:
+                    break
+        if frames:
+            df = pd.concat(frames, ignore_index=True)
+        return self._report_frame(df, columns)
+
+    def search_count(self, text, severity=None, label=None, since=None):
+        where, params = self._where(severity, label, since)
+        return self._connect().execute(f"SELECT COUNT(*) FROM ({SEARCH_ROWS}){where}",
+                                       [search_expression(text)] + params).fetchone()[0]
+
+    # One page of the flagged messages containing every word of `text`, live
+    # and archived, best BM25 match first, in query()'s frame shape. Archived
+    # hits are read from the segments of their days only.
+    def search(self, text, severity=None, label=None, since=None, columns=None, limit=50, offset=0):
+        columns = columns or list(COLUMNS)
+        table_columns = [COLUMNS[column] for column in columns]
+        where, params = self._where(severity, label, since)
+        conn = self._connect()
+        hits = pd.read_sql_query(f"SELECT id, day, live FROM ({SEARCH_ROWS}){where} ORDER BY rank, id DESC "
+                                 "LIMIT ? OFFSET ?", conn, params=[search_expression(text)] + params + [limit, offset])
+        live_ids = hits.loc[hits["live"] == 1, "id"].tolist()
+        frames = [typed_history(pd.read_sql_query(
+            f"SELECT id, {', '.join(table_columns)} FROM flagged WHERE id IN ({', '.join('?' * len(live_ids))})",
+            conn, params=live_ids))]
+        usecols = [column for column in ARCHIVE_COLUMNS if column in set(table_columns) | {"id"}]
+        for day, day_hits in hits[hits["live"] == 0].groupby("day"):
+            for path in self.partitions(datetime.strptime(day, "%Y-%m-%d")):
+                if PARTITION_PATTERN.match(os.path.basename(path)).group(1) != day:
+                    break
+                frames.append(self._read_partition(path, usecols, ids=day_hits["id"].tolist())[["id"] + table_columns])
+        frames = [frame for frame in frames if len(frame)] or frames[:1]
+        df = pd.concat(frames, ignore_index=True).drop_duplicates("id")
+        position = pd.Series(range(len(hits)), index=hits["id"])
+        df = df.sort_values("id", key=lambda ids: ids.map(position), ignore_index=True)
+        return self._report_frame(df, columns)
+
+    # The rows query() returns as frames of at most `chunk_size` rows, for
+    # exports: archived segments oldest first, then the live table. Live chunks
+    # are keyset queries (id > last id), so no read transaction stays open
+    # between chunks and the generator can be advanced from any thread.
+    def iter_query(self, severity=None, label=None, since=None, columns=None, chunk_size=50000):
+        columns = columns or list(COLUMNS)
+        table_columns = [COLUMNS[column] for column in columns]
+        usecols = self._archive_usecols(table_columns, severity, label, since)
+        for path in self.partitions(since):
+            rows = self._filter_frame(self._read_partition(path, usecols), severity, label, since)
+            rows = rows.sort_values("id", kind="stable")[["id"] + table_columns]
+            for start in range(0, len(rows), chunk_size):
+                yield self._report_frame(rows.iloc[start:start + chunk_size].reset_index(drop=True), columns)
+
+        where, params = self._where(severity, label, since)
+        where += " AND id > ?" if where else " WHERE id > ?"
+        last_id = 0
+        while True:
+            df = pd.read_sql_query(f"SELECT id, {', '.join(table_columns)} FROM flagged{where} ORDER BY id LIMIT ?",
+                                   self._connect(), params=params + [last_id, chunk_size])
+            if not len(df):
+                return
+            last_id = int(df["id"].iloc[-1])
+            yield self._report_frame(typed_history(df), columns)
+
+    # One-time conversion of CSV segments into the store's archive format (one
+    # segment per day); returns the number of days converted
+    def migrate_archive(self):
+        days = {}
+        for path in self.partitions():
+            day, archive_format = PARTITION_PATTERN.match(os.path.basename(path)).groups()
+            if archive_format != self.archive_format:
+                days.setdefault(day, []).append(path)
+        for day, paths in days.items():
+            rows = pd.concat([self._read_partition(path, ARCHIVE_COLUMNS) for path in paths], ignore_index=True)
+            self._write_partition(day, rows.drop_duplicates("id"))
+            for path in paths:
+                os.remove(path)
+        return len(days)
+
+# Rows FlagWriter keeps after failing to write them, for inspection
+REJECTED_ROWS_KEPT = 1000
+
+# Queued writer for flagged messages: append() only enqueues, and a single
+# background thread commits the queue in batches of up to `max_batch_size` rows,
+# waiting at most `flush_interval` seconds to fill a batch. Each batch is one
+# transaction under SQLite's write lock, so concurrent sessions and processes
+# never interleave partial rows. Durability per commit follows the store's
+# `synchronous` policy. Pending rows are flushed at interpreter exit.
+class FlagWriter(QueueBatcher):
+    def __init__(self, store, max_batch_size=500, flush_interval=0.05, retries=5):
+        self.store = store
+        self.retries = retries
+        self.written = 0
+        self.failed = 0
+        self.last_error = None
+        # The most recent rows that could not be written
+        self.rejected = collections.deque(maxlen=REJECTED_ROWS_KEPT)
+        self._queued = 0
+        self._done = 0
+        self._done_changed = threading.Condition()
+        super().__init__(max_batch_size, flush_interval, "flag-writer")
+        atexit.register(self.close)
+
+    def append(self, message, label, confidence, severity, timestamp=None):
+        if self._closed:
+            raise RuntimeError("FlagWriter is closed")
+        timestamp = timestamp or datetime.now().strftime(TIMESTAMP_FORMAT)
+        with self._done_changed:
+            self._queued += 1
+        self._queue.put((message, str(label), float(confidence), float(severity), timestamp))
+
+    # Block until every row appended before this call is committed (or failed)
+    def flush(self, timeout=None):
+        with self._done_changed:
+            target = self._queued
+            return self._done_changed.wait_for(lambda: self._done >= target, timeout)
+
+    def pending(self):
+        with self._done_changed:
+            return self._queued - self._done
+
+    # A batch that fails for any reason other than lock contention is written
+    # again row by row, so one bad row does not take the rest of the batch
+    # with it; rows that still cannot be written are kept in `rejected`
+    def _write(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.span("log_write"):
+                    self.store.append_many(batch)
+                self.written += len(batch)
+                return
+            except sqlite3.OperationalError as e:
+                # Typically "database is locked" when another process holds the write lock too long
+                self.last_error = e
+                time.sleep(0.05 * 2 ** attempt)
+            except Exception as e:
+                self.last_error = e
+                if len(batch) == 1:
+                    break
+                for row in batch:
+                    self._write([row])
+                return
+        self._reject(batch, self.last_error)
+
+    def _reject(self, rows, error):
+        self.failed += len(rows)
+        self.rejected.extend(rows)
+        print(f"FlagWriter: could not write {len(rows)} flagged message(s): {error}", file=sys.stderr)
+
+    def _process(self, batch):
+        try:
+            self._write(batch)
+        except Exception as e:
+            self.last_error = e
+            self._reject(batch, e)
+        with self._done_changed:
+            self._done += len(batch)
+            self._done_changed.notify_all()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the flagged message store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rotate = subparsers.add_parser("rotate", help="move old rows into per-day archive segments")
+    rotate.add_argument("--retain-days", type=int, default=DEFAULT_RETAIN_DAYS)
+    migrate = subparsers.add_parser("migrate", help="convert archive segments to another format")
+    for subparser in (rotate, migrate):
+        subparser.add_argument("--db", default=DB_PATH)
+        subparser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+        subparser.add_argument("--format", choices=ARCHIVE_FORMATS, default=DEFAULT_ARCHIVE_FORMAT)
+    args = parser.parse_args(argv)
+
+    store = FlagStore(args.db, legacy_csv=None, archive_dir=args.archive_dir, archive_format=args.format)
+    if args.command == "rotate":
+        moved = store.rotate(args.retain_days)
+        print(f"Moved {moved:,} rows into {args.archive_dir} ({len(store.partitions()):,} segments)")
+    else:
+        print(f"Converted {store.migrate_archive():,} days of history to {args.format}")
+
+if __name__ == "__main__":
+    main()
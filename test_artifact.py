@@ -0,0 +1,54 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+
+import artifact
+
+# Parity of the compact artifact and the LinearScorer fast path with the
+# shipped scikit-learn pickles:
+#
+#   python -m pytest test_artifact.py
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(HERE, "cyberbullying_model.pkl")
+VECTORIZER_PATH = os.path.join(HERE, "tfidf_vectorizer.pkl")
+
+@pytest.fixture(scope="module")
+def models():
+    return joblib.load(MODEL_PATH), joblib.load(VECTORIZER_PATH)
+
+@pytest.fixture(scope="module")
+def compact(models, tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("artifact") / "model_artifact")
+    artifact.export_artifact(*models, directory, source_version="test")
+    return artifact.load_artifact(directory)
+
+def test_compact_artifact_matches_estimator(models, compact):
+    report = artifact.check_parity(*models, *compact)
+    assert report["matrix_equal"]
+    assert report["proba_equal"]
+    assert report["labels_equal"]
+    assert report["max_confidence_diff"] == 0.0
+
+def test_linear_scorer_matches_predict_proba(models):
+    model, vectorizer = models
+    texts = ["", "I HATE you, idiot!!", "have a nice day", "go kill yourself loser", "hey idiot", "hello idiot"]
+    X = vectorizer.transform(texts)
+    labels, confidences = artifact.LinearScorer(model).predict(X)
+    proba = model.predict_proba(X)
+    assert np.array_equal(labels.astype(str), model.predict(X).astype(str))
+    assert np.array_equal(confidences, proba.max(axis=1))
+
+def test_compact_vectorizer_matches_transform(models, compact):
+    texts = ["Ünïcödé idiot", "you   are\nan idiot", "123 abc", "x" * 300]
+    expected = models[1].transform(texts)
+    actual = compact[1].transform(texts)
+    assert (expected != actual).nnz == 0
+
+def test_artifact_only_current_for_its_source(tmp_path, models):
+    directory = str(tmp_path / "model_artifact")
+    artifact.export_artifact(*models, directory, source_version="a")
+    assert artifact.is_current(directory, "a")
+    assert not artifact.is_current(directory, "b")
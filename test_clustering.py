@@ -0,0 +1,54 @@
+import os
+
+import joblib
+import pytest
+
+from clustering import NearDuplicateIndex
+from storage import FlagStore
+
+# Near-duplicate decisions of the clusterer with the shipped model, for
+# messages logged in one batch and one at a time:
+#
+#   python -m pytest test_clustering.py
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+NEAR_DUPLICATES = [
+    ("hey idiot", "hello idiot"),
+    ("go kill yourself loser", "go kill yourself you loser"),
+    ("you are an idiot", "YOU ARE AN IDIOT!!"),
+]
+
+DISTINCT = [
+    ("my teacher at school is mean to everyone", "we had a school trip to the museum today"),
+    ("dumb", "he is a dumb boy"),
+    ("you idiot", "what an idiot, go die you worthless idiot"),
+    ("jokes ignored lmao", "administration responsible jokes sold"),
+    ("i will kill you", "i will hug you"),
+]
+
+@pytest.fixture(scope="module")
+def index():
+    model = joblib.load(os.path.join(HERE, "cyberbullying_model.pkl"))
+    vectorizer = joblib.load(os.path.join(HERE, "tfidf_vectorizer.pkl"))
+    return NearDuplicateIndex(vectorizer, model)
+
+def cluster_count(index, directory, messages, batch):
+    store = FlagStore(os.path.join(directory, "flags.db"), legacy_csv=None,
+                      archive_dir=os.path.join(directory, "history"), clusterer=index)
+    if batch:
+        store.append_many([(message, "age", 90.0, 50.0, None) for message in messages])
+    else:
+        for message in messages:
+            store.append(message, "age", 90.0, 50.0)
+    return store.cluster_summary()["clusters"]
+
+@pytest.mark.parametrize("batch", [True, False])
+@pytest.mark.parametrize("messages", NEAR_DUPLICATES)
+def test_near_duplicates_share_a_cluster(index, tmp_path, messages, batch):
+    assert cluster_count(index, str(tmp_path), messages, batch) == 1
+
+@pytest.mark.parametrize("batch", [True, False])
+@pytest.mark.parametrize("messages", DISTINCT)
+def test_distinct_messages_on_one_topic_do_not(index, tmp_path, messages, batch):
+    assert cluster_count(index, str(tmp_path), messages, batch) == 2